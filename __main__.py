@@ -1,21 +1,29 @@
-import backend
 import argparse
+import backend.app
+from backend import server
 
 parser = argparse.ArgumentParser("Run the server with arguments.")
-parser.add_argument("--host", action="store",
+parser.add_argument("--host", action="store", default="127.0.0.1",
                     help="host IP address on which the app runs. Default value is 127.0.0.1.")
-parser.add_argument("--port", action="store",
+parser.add_argument("--port", action="store", type=int, default=5000,
                     help="port number on which the app runs. Default value is 5000.")
+parser.add_argument("--server", action="store", choices=["dev", "prod"], default="dev",
+                    help="dev runs Flask's development server; prod runs pre-forked gunicorn workers. "
+                         "Default value is dev.")
+parser.add_argument("--workers", action="store", type=int, default=server.default_workers(),
+                    help="number of worker processes of the prod server. Default value is 2 * CPUs + 1.")
+parser.add_argument("--threads", action="store", type=int, default=4,
+                    help="number of threads per worker of the prod server. Default value is 4.")
 
 args = parser.parse_args()
 
 # Run in console
 # python3 EmotionaYouTube --host --port
-if args.host and args.port:
-    backend.app.app.run(host=args.host, port=args.port)
-elif args.host:
-    backend.app.app.run(host=args.host, port=5000)
-elif args.port:
-    backend.app.app.run(host="127.0.0.1", port=args.port)
+# python3 EmotionaYouTube --server prod --workers --threads
+if args.server == "prod":
+    server.serve(backend.app.app, host=args.host, port=args.port,
+                 workers=args.workers, threads=args.threads)
 else:
-    backend.app.app.run(host="127.0.0.1", port=5000)
+    server.warm_up()
+    backend.app.start_background()
+    backend.app.app.run(host=args.host, port=args.port)
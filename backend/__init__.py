@@ -1 +0,0 @@
-from . import app
\ No newline at end of file
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+Emotional-YouTube Comment Analyzers
+Jan(Zhan) Lu and Haoyan Wang, Winter 2020
+
+This code is provided for non-commercial and study purpose.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, should conform to the open source licence as provided.
+
+"""
+
+import os
+import re
+import math
+import threading
+import contextvars
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import List, Optional, Tuple
+import numpy as np
+from google.cloud import language_v1 as language
+from . import clients, datatypes, quota
+
+GOOGLE = "google"
+LOCAL = "local"
+AUTO = "auto"
+# comments are sent to NLP as paragraphs of one document
+COMMENT_SEPARATOR = "\n\n"
+# NLP bills a document per record of this many characters
+CHARACTERS_PER_RECORD = 1000
+# the comments of a call are packed into documents of at most this many
+# utf-8 bytes, far below the limit of NLP, and annotated at once by at most
+# DOCUMENT_CONCURRENCY threads
+MAX_DOCUMENT_BYTES = 32 * 1024
+DOCUMENT_CONCURRENCY = 8
+# seconds the Google analyzer may take in auto mode before the local one is used
+DEFAULT_TIMEOUT = 5
+
+_DAT = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..", "dat")
+LEXICON_PATH = os.path.join(_DAT, "en_lexicon.txt")
+STOPWORDS_PATH = os.path.join(_DAT, "en_stopwords.txt")
+TOKEN_PATTERN = re.compile(r"[a-z]+(?:'[a-z]+)?")
+SENTENCE_END_PATTERN = re.compile(r"[.!?]+")
+# a negator flips and damps the score of the next word, an intensifier raises it
+NEGATORS = {"not", "no", "never", "isn't", "wasn't", "don't", "doesn't", "didn't", "can't", "won't",
+            "aren't", "nothing", "hardly", "without"}
+INTENSIFIERS = {"very", "so", "really", "extremely", "super", "absolutely", "totally", "truly", "incredibly"}
+NEGATION_FACTOR = -0.5
+INTENSIFIER_FACTOR = 1.5
+# sum / sqrt(sum^2 + alpha) maps the summed word scores into (-1, 1)
+NORMALIZATION_ALPHA = 1.0
+# unknown words with these endings are taken for adjectives
+ADJECTIVE_SUFFIXES = ("ful", "less", "ous", "ive", "able", "ible", "ical", "ish", "esque", "est")
+MIN_ADJECTIVE_LENGTH = 5
+
+
+class Analyzer:
+    """Abstract class of an analyzer, which finds the sentiment and the
+    adjectives of each comment.
+
+    === Attributes ===
+    name: name of the analyzer, part of the keys of the cached analyses.
+    """
+
+    name: str
+
+    def supports(self, lang: str) -> bool:
+        """Return whether the analyzer handles comments in the language."""
+        return True
+
+    def analyze(self, comments: List[str], lang: str) -> List[datatypes.CommentAnalysis]:
+        """Return the analyses of the comments, in order."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"name": self.name}
+
+
+class GoogleAnalyzer(Analyzer):
+    """Analyzer calling Google Natural Language for the tokens with their
+    part of speech and the sentiment of each sentence. The comments are
+    packed on comment boundaries into documents of at most
+    max_document_bytes, which are annotated concurrently, so a call takes
+    as long as its slowest document. The sentences and tokens are mapped
+    back to their comments by offset.
+
+    === Attributes ===
+    max_document_bytes: utf-8 bytes of a document, unless one comment
+                        alone is longer.
+    """
+
+    max_document_bytes: int
+
+    def __init__(self, pool: Optional[clients.LanguageClientPool] = None,
+                 max_document_bytes: int = MAX_DOCUMENT_BYTES, concurrency: int = DOCUMENT_CONCURRENCY):
+        self.name = GOOGLE
+        self.max_document_bytes = max_document_bytes
+        self._pool = pool or clients.LanguageClientPool()
+        self._documents = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="nlp")
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._document_count = 0
+
+    def analyze(self, comments: List[str], lang: str) -> List[datatypes.CommentAnalysis]:
+        if not comments:
+            return []
+        sizes = [len(comment.encode("utf-8")) for comment in comments]
+        documents = _pack(sizes, self.max_document_bytes)
+        with self._lock:
+            self._calls += 1
+            self._document_count += len(documents)
+        if len(documents) == 1:
+            return self._analyze_document(comments, sizes)
+        # the documents are annotated in the quota priority class of the caller
+        futures = [self._documents.submit(contextvars.copy_context().run, self._analyze_document,
+                                          comments[start:end], sizes[start:end])
+                   for start, end in documents]
+        return [analysis for future in futures for analysis in future.result()]
+
+    def _analyze_document(self, comments: List[str], sizes: List[int]) -> List[datatypes.CommentAnalysis]:
+        """Annotate the comments as the paragraphs of one document."""
+        starts = []
+        offset = 0
+        for size in sizes:
+            starts.append(offset)
+            offset += size + len(COMMENT_SEPARATOR)
+        annotation = _annotate(self._pool.get(), COMMENT_SEPARATOR.join(comments))
+
+        analyses = [datatypes.CommentAnalysis(analyzer=self.name) for _ in comments]
+        for sentence in annotation.sentences:
+            comment = bisect_right(starts, sentence.text.begin_offset) - 1
+            analyses[comment].add_sentence(sentence.sentiment.score, sentence.sentiment.magnitude)
+        _extract_adjective(annotation, starts, analyses)
+        return analyses
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls, documents = self._calls, self._document_count
+        return dict(super().stats(), **self._pool.stats(), analyze_calls=calls, documents=documents,
+                    max_document_bytes=self.max_document_bytes)
+
+
+def _pack(sizes: List[int], max_bytes: int) -> List[Tuple[int, int]]:
+    """Function to pack comments of the given utf-8 sizes, in order, into
+    documents of at most max_bytes with their separators. Returns the
+    (start, end) range of the comments of each document; a comment longer
+    than max_bytes is a document of its own.
+    """
+    documents = []
+    start = 0
+    used = 0
+    for end, size in enumerate(sizes):
+        needed = size + (len(COMMENT_SEPARATOR) if end > start else 0)
+        if end > start and used + needed > max_bytes:
+            documents.append((start, end))
+            start, used, needed = end, 0, size
+        used += needed
+    documents.append((start, len(sizes)))
+    return documents
+
+
+def _annotate(client: language.LanguageServiceClient, text: str) -> language.AnnotateTextResponse:
+    """Function to call NLP once for the tokens with their part of speech,
+    and for the sentiment of the document and of its sentences.
+    """
+    # instantiates a plain text document
+    document = {
+        "type_": language.Document.Type.PLAIN_TEXT,
+        "content": text
+    }
+    features = {"extract_syntax": True, "extract_document_sentiment": True}
+    quota.acquire("language.annotateText", math.ceil(len(text) / CHARACTERS_PER_RECORD))
+    return client.annotate_text(
+        request={"document": document, "features": features, "encoding_type": language.EncodingType.UTF8})
+
+
+def _extract_adjective(annotation: language.AnnotateTextResponse, starts: List[int],
+                       analyses: List[datatypes.CommentAnalysis]) -> None:
+    """Function to pull out the lemmas of all adjectives from the tokens of
+    the text, into the analyses of the comments they belong to. starts are
+    the utf-8 offsets at which the comments begin.
+    """
+    for token in annotation.tokens:
+        # append all adjectives to result
+        part_of_speech_tag = language.PartOfSpeech.Tag(token.part_of_speech.tag)
+        if part_of_speech_tag.name == "ADJ":
+            comment = bisect_right(starts, token.text.begin_offset) - 1
+            analyses[comment].adjectives.append(token.lemma or token.text.content)
+
+
+class LocalAnalyzer(Analyzer):
+    """Analyzer running in the process, for English comments. All the words
+    of a batch of comments are scored at once against a sentiment lexicon,
+    with negators and intensifiers applied to the next word; the sum of each
+    comment is mapped into (-1, 1). Adjectives are the adjectives of the
+    lexicon, and unknown words with an adjective ending.
+
+    === Attributes ===
+    lexicon_size: number of words of the lexicon.
+    """
+
+    lexicon_size: int
+
+    def __init__(self, lexicon_path: str = LEXICON_PATH, stopwords_path: str = STOPWORDS_PATH):
+        self.name = LOCAL
+        words, scores, adjectives = [], [], []
+        with open(lexicon_path, encoding="utf-8") as file:
+            for line in file:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                word, score, part_of_speech = line.rstrip("\n").split("\t")
+                words.append(word)
+                scores.append(float(score))
+                adjectives.append(part_of_speech == "a")
+        with open(stopwords_path, encoding="utf-8") as file:
+            self._stopwords = {word.strip() for word in file}
+        self._index = {word: i for i, word in enumerate(words)}
+        # one more slot for unknown words, at index -1
+        self._scores = np.array(scores + [0.0])
+        self._adjectives = np.array(adjectives + [False])
+        self.lexicon_size = len(words)
+
+    def supports(self, lang: str) -> bool:
+        return lang == "en"
+
+    def analyze(self, comments: List[str], lang: str) -> List[datatypes.CommentAnalysis]:
+        if not comments:
+            return []
+        tokens = [TOKEN_PATTERN.findall(comment.casefold()) for comment in comments]
+        counts = np.fromiter(map(len, tokens), dtype=np.int64, count=len(comments))
+        owner = np.repeat(np.arange(len(comments)), counts)
+        flat = [token for comment in tokens for token in comment]
+        ids = np.fromiter((self._index.get(token, -1) for token in flat), dtype=np.int64, count=len(flat))
+
+        values = self._scores[ids]
+        # the modifier applies to the next word of the same comment
+        same_comment = np.zeros(len(flat), dtype=bool)
+        same_comment[1:] = owner[1:] == owner[:-1]
+        negated = np.zeros(len(flat), dtype=bool)
+        intensified = np.zeros(len(flat), dtype=bool)
+        negated[1:] = np.fromiter((token in NEGATORS for token in flat[:-1]), dtype=bool)
+        intensified[1:] = np.fromiter((token in INTENSIFIERS for token in flat[:-1]), dtype=bool)
+        values = np.where(negated & same_comment, values * NEGATION_FACTOR, values)
+        values = np.where(intensified & same_comment, values * INTENSIFIER_FACTOR, values)
+
+        sums = np.bincount(owner, weights=values, minlength=len(comments))
+        magnitudes = np.bincount(owner, weights=np.abs(values), minlength=len(comments))
+        scores = sums / np.sqrt(sums * sums + NORMALIZATION_ALPHA)
+        is_adjective = self._adjectives[ids]
+
+        analyses = []
+        position = 0
+        for i, comment in enumerate(comments):
+            end = position + counts[i]
+            adjectives = [flat[j] for j in range(position, end)
+                          if is_adjective[j] or (ids[j] < 0 and self._looks_adjective(flat[j]))]
+            sentences = len(SENTENCE_END_PATTERN.findall(comment.rstrip(" .!?"))) + 1 if counts[i] else 0
+            analyses.append(datatypes.CommentAnalysis(float(scores[i]), float(magnitudes[i]), sentences,
+                                                      adjectives, analyzer=self.name))
+            position = end
+        return analyses
+
+    def _looks_adjective(self, word: str) -> bool:
+        return len(word) >= MIN_ADJECTIVE_LENGTH and word.endswith(ADJECTIVE_SUFFIXES) \
+            and word not in self._stopwords
+
+    def stats(self) -> dict:
+        return dict(super().stats(), lexicon_size=self.lexicon_size)
+
+
+class FallbackAnalyzer(Analyzer):
+    """Analyzer running the primary analyzer, and the fallback one instead
+    when the primary fails or takes more than timeout seconds. Its name is
+    the one of the primary, whose results only are cached.
+
+    === Attributes ===
+    timeout: seconds the primary analyzer may take.
+    """
+
+    timeout: float
+
+    def __init__(self, primary: Analyzer, fallback: Analyzer, timeout: float = DEFAULT_TIMEOUT):
+        self.name = primary.name
+        self.timeout = timeout
+        self._primary = primary
+        self._fallback = fallback
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="analyzer")
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._fallbacks = 0
+
+    def supports(self, lang: str) -> bool:
+        return self._primary.supports(lang) or self._fallback.supports(lang)
+
+    def analyze(self, comments: List[str], lang: str) -> List[datatypes.CommentAnalysis]:
+        with self._lock:
+            self._calls += 1
+        if not self._fallback.supports(lang):
+            return self._primary.analyze(comments, lang)
+        # the primary runs in the quota priority class of the caller
+        future = self._pool.submit(contextvars.copy_context().run, self._primary.analyze, comments, lang)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            print(f"{self._primary.name} analyzer took more than {self.timeout}s, "
+                  f"falling back to {self._fallback.name}")
+        except Exception as e:
+            # TODO: logging
+            print(e)
+        with self._lock:
+            self._fallbacks += 1
+        return self._fallback.analyze(comments, lang)
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls, fallbacks = self._calls, self._fallbacks
+        return {"name": AUTO, "calls": calls, "fallbacks": fallbacks, "timeout": self.timeout,
+                "primary": self._primary.stats(), "fallback": self._fallback.stats()}
+
+
+def create(kind: str, timeout: float = DEFAULT_TIMEOUT) -> Analyzer:
+    """Function to create the analyzer of the given kind: google, local, or
+    auto for google with the local analyzer as fallback."""
+    if kind == GOOGLE:
+        return GoogleAnalyzer()
+    if kind == LOCAL:
+        return LocalAnalyzer()
+    if kind == AUTO:
+        return FallbackAnalyzer(GoogleAnalyzer(), LocalAnalyzer(), timeout)
+    raise ValueError(f"Unknown analyzer {kind}")
+
+
+# analyzer used by the reports, see configure()
+_analyzer: Optional[Analyzer] = None
+
+
+def configure(kind: str = GOOGLE, timeout: float = DEFAULT_TIMEOUT) -> Analyzer:
+    """Function to set up the analyzer of the reports."""
+    global _analyzer
+    _analyzer = create(kind, timeout)
+    return _analyzer
+
+
+def default_analyzer() -> Analyzer:
+    """Function returns the analyzer of the reports."""
+    return _analyzer or configure()
@@ -11,12 +11,27 @@ any changes, should conform to the open source licence as provided.
 """
 
 import os
-import base64
+import json
+import math
+from io import BytesIO
+from typing import Optional
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from . import db
 from . import interface
+from . import utils
 from . import datatypes
+from . import blobstore
+from . import analyzers
+from . import quota
+from . import render
+from .jobs import JobManager, JobQueueFull, DONE, FAILED
+from .refresher import Refresher
+from .respcache import CachedResponse, ResponseCache
+from .singleflight import SingleFlight
 from flask_cors import cross_origin
-from flask import Flask, jsonify
+from flask import Flask, Response, abort, jsonify, request, send_file, stream_with_context, url_for
+from googleapiclient.errors import HttpError
 
 
 # init app
@@ -24,12 +39,164 @@ app = Flask(__name__)
 
 # config app
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(basedir, r"..\dat\db.sqlite")
+# set EMOTIONAL_YOUTUBE_DATABASE_URI to use another database, e.g. in tests
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("EMOTIONAL_YOUTUBE_DATABASE_URI",
+                                                       "sqlite:///" + os.path.join(basedir, r"..\dat\db.sqlite"))
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# "sync" commits every write in the request; "write-behind" switches SQLite to
+# WAL and commits writes in batches every DB_WRITE_INTERVAL seconds
+app.config["DB_STORAGE_MODE"] = "sync"
+app.config["DB_WRITE_INTERVAL"] = 0.005
+app.config["DB_WRITE_MAX_BATCH"] = 500
+# tiers in front of the database: entries kept in the memory of each process
+# for at most CACHE_MEMORY_TTL_SECONDS, and in a Redis server shared by the
+# hosts when CACHE_REDIS_URL is set, e.g. "redis://localhost:6379/0"
+app.config["CACHE_MEMORY_ENTRIES"] = 10000
+app.config["CACHE_MEMORY_TTL_SECONDS"] = 60
+app.config["CACHE_REDIS_URL"] = os.environ.get("EMOTIONAL_YOUTUBE_REDIS_URL")
+app.config["CACHE_REDIS_TTL_SECONDS"] = 24 * 3600
+# comment analyzer: "google" (Natural Language API), "local" (in-process,
+# English only), or "auto" for google with local as fallback when it fails
+# or takes more than ANALYZER_TIMEOUT_SECONDS
+app.config["ANALYZER"] = os.environ.get("EMOTIONAL_YOUTUBE_ANALYZER", "google")
+app.config["ANALYZER_TIMEOUT_SECONDS"] = 5
+# analyses of single comments kept for reuse across reports
+app.config["COMMENT_CACHE_MAX_ENTRIES"] = 1000000
+# comments analyzed per video, and the seconds allowed to fetch them
+app.config["COMMENT_BUDGET"] = 100
+app.config["COMMENT_DEADLINE_SECONDS"] = 10
+# refresh expired reports by fetching only the comments posted since
+app.config["INCREMENTAL_REFRESH"] = True
+# seconds a request waits for a report; when they run out, the comments
+# fetched so far are analyzed and the report is returned partial, to be
+# completed in the background
+app.config["REPORT_DEADLINE_SECONDS"] = 8
+# "sync" runs the analysis inside the request; "job" answers cache misses with
+# 202 and a job id. Clients may choose per request with ?mode=sync|job.
+app.config["REPORT_MODE"] = "sync"
+app.config["JOB_WORKERS"] = 4
+app.config["JOB_MAX_PENDING"] = 256
+app.config["JOB_RETENTION_SECONDS"] = 600
+# seconds between keep-alive comments on the job event stream
+app.config["JOB_EVENTS_KEEPALIVE"] = 15
+# serve expired reports at once and refresh them in the background, unless
+# they are older than the hard cutoff
+app.config["STALE_WHILE_REVALIDATE"] = True
+app.config["MAX_STALENESS_SECONDS"] = 30 * 24 * 3600
+# batch analysis
+app.config["BATCH_MAX_IDS"] = 500
+app.config["BATCH_WORKERS"] = 8
+# word-cloud images are immutable under their versioned url
+app.config["WCLOUD_MAX_AGE"] = 365 * 24 * 3600
+# content-addressed store of the word-cloud images, least recently used
+# images are evicted beyond WCLOUD_STORE_MAX_BYTES
+app.config["WCLOUD_STORE_PATH"] = os.path.join(basedir, "..", "dat", "wcloud.sqlite")
+app.config["WCLOUD_STORE_MAX_BYTES"] = 1024 * 1024 * 1024
+# word clouds are laid out in a pool of worker processes, at most
+# RENDER_MAX_PENDING at once, each given at most RENDER_TIMEOUT_SECONDS
+app.config["RENDER_WORKERS"] = render.RENDER_WORKERS
+app.config["RENDER_MAX_PENDING"] = 2 * render.RENDER_WORKERS
+app.config["RENDER_TIMEOUT_SECONDS"] = render.RENDER_TIMEOUT_SECONDS
+# bytes of serialized report responses kept in memory
+app.config["RESPONSE_CACHE_MAX_BYTES"] = 64 * 1024 * 1024
+# background refresh of the reports about to expire, spending at most
+# REFRESH_DAILY_QUOTA_UNITS YouTube Data API units per day
+app.config["REFRESHER_ENABLED"] = True
+app.config["REFRESH_INTERVAL"] = 60
+app.config["REFRESH_LOOKAHEAD_SECONDS"] = 3600
+app.config["REFRESH_BATCH"] = 20
+app.config["REFRESH_DAILY_QUOTA_UNITS"] = 2000
+# quota of the upstream APIs, kept in the state file QUOTA_STATE_PATH so that
+# the worker processes of the host share it, also across restarts; interactive
+# requests go first, then the background refreshes, then the batch requests,
+# which leave QUOTA_RESERVES of the quota to the classes above them
+app.config["QUOTA_YOUTUBE_DAILY_UNITS"] = 10000
+app.config["QUOTA_LANGUAGE_UNITS_PER_MINUTE"] = 600
+app.config["QUOTA_RESERVES"] = dict(quota.DEFAULT_RESERVES)
+app.config["QUOTA_MAX_WAIT_SECONDS"] = dict(quota.DEFAULT_MAX_WAITS)
+app.config["QUOTA_STATE_PATH"] = os.environ.get("EMOTIONAL_YOUTUBE_QUOTA_STATE_PATH",
+                                                os.path.join(basedir, "..", "dat", "quota.json"))
 
 # config, create database, and update the bound app with sqlalchemy and marshmallow
 app = db.init_db(app)
 
+# word-cloud images of the reports, keyed by their sha256 digest
+_images = blobstore.configure(app.config["WCLOUD_STORE_PATH"], app.config["WCLOUD_STORE_MAX_BYTES"])
+
+# renderer of the word-cloud images, its workers are started by
+# start_background()
+_renderer = render.configure(app.config["RENDER_WORKERS"], app.config["RENDER_MAX_PENDING"],
+                             app.config["RENDER_TIMEOUT_SECONDS"])
+
+# analyzer of the comments of the reports
+analyzers.configure(app.config["ANALYZER"], app.config["ANALYZER_TIMEOUT_SECONDS"])
+
+# token buckets of the quota of the upstream APIs
+quota.configure({
+    "youtube": (app.config["QUOTA_YOUTUBE_DAILY_UNITS"], app.config["QUOTA_YOUTUBE_DAILY_UNITS"] / 86400),
+    "language": (app.config["QUOTA_LANGUAGE_UNITS_PER_MINUTE"], app.config["QUOTA_LANGUAGE_UNITS_PER_MINUTE"] / 60)
+}, app.config["QUOTA_RESERVES"], app.config["QUOTA_MAX_WAIT_SECONDS"], app.config["QUOTA_STATE_PATH"])
+
+# coalesces concurrent cache misses and refreshes of the same video
+_in_flight = SingleFlight()
+
+
+def _in_app_context(fn, *args, level: str = quota.INTERACTIVE):
+    """Helper function to call fn(*args) in an app context, for threads
+    other than the request threads. Its upstream calls take their quota in
+    the priority class level."""
+    with app.app_context(), quota.priority(level):
+        return fn(*args)
+
+
+def _run_job(job, vid: str, exists: bool, level: str = quota.INTERACTIVE) -> db.ReportLookup:
+    """Helper function to run the pipeline of a background job. A failed
+    background refresh is recorded, so that the refresher backs off."""
+    try:
+        return _in_app_context(_in_flight.do, vid, _run_pipeline, vid, exists, job.progress, level=level)
+    except Exception:
+        if level == quota.BACKGROUND:
+            _in_app_context(db.DBM.record_refresh_failure, vid)
+        raise
+
+
+# bounded pool running the analysis of job mode requests
+_jobs = JobManager(_run_job, max_workers=app.config["JOB_WORKERS"],
+                   max_pending=app.config["JOB_MAX_PENDING"],
+                   retention=app.config["JOB_RETENTION_SECONDS"])
+
+# bounded pool running the analysis of batch requests
+_batch_pool = ThreadPoolExecutor(max_workers=app.config["BATCH_WORKERS"],
+                                 thread_name_prefix="batch")
+
+# serialized and compressed responses of fresh reports, dropped on each write
+_responses = ResponseCache(app.config["RESPONSE_CACHE_MAX_BYTES"])
+db.DBM.add_write_listener(_responses.invalidate)
+db.DBM.add_drop_listener(_responses.discard)
+
+
+
+def _schedule_refresh(vid: str) -> bool:
+    """Helper function to schedule the background refresh of the video for
+    the refresher. Returns False if a job of the video is already running,
+    whose quota units are not charged again."""
+    if _jobs.is_active(vid):
+        return False
+    _jobs.submit(vid, vid, True, quota.BACKGROUND)
+    return True
+
+
+# refreshes the reports expiring soonest; one process refreshes at a time
+_refresher = Refresher(
+    lambda limit, before: _in_app_context(db.DBM.select_soonest_expiring, limit, before),
+    _schedule_refresh,
+    units_per_refresh=utils.estimated_quota_units(app.config["COMMENT_BUDGET"]),
+    budget_units=app.config["REFRESH_DAILY_QUOTA_UNITS"],
+    interval=app.config["REFRESH_INTERVAL"],
+    lookahead=timedelta(seconds=app.config["REFRESH_LOOKAHEAD_SECONDS"]),
+    batch_size=app.config["REFRESH_BATCH"],
+    lock_path=os.path.join(basedir, "..", "dat", "refresher.lock"))
+
 
 @app.route("/analysis/<vid>", methods=["GET"])
 @cross_origin()
@@ -38,41 +205,449 @@ def rest_return_report(vid: str):
     formatted json file on success; returns empty json file otherwise.
     """
     # TODO: logging
-    if db.DBM.does_exist(vid):
-        report = db.DBM.select_report_from_db(vid)
-        if not report:
+    cached = _responses.get(vid)
+    if cached and not db.DBM.has_expired(cached.expires_at):
+        return _send_cached(cached)
+
+    entry = db.DBM.lookup(vid)
+    if entry.exists:
+        if not entry.report:
             # means the id is not valid and recorded
             return jsonify()
-        elif not db.DBM.is_expired(vid):
-            return process_response(report)
+        elif not entry.expired:
+            if entry.report.partial:
+                _complete_later(vid)
+            return process_response(entry)
+        elif _can_serve_stale(entry):
+            return _serve_stale(vid, entry)
+        elif _job_mode():
+            return _accept_job(vid, True)
         else:
-            new_video_meta, new_report = interface.main(vid)
-            db.DBM.update_entry(vid, new_video_meta, new_report)
-            return process_response(new_report)
+            new_entry = _run_within_deadline(vid, True)
+            return process_response(new_entry)
+    elif _job_mode():
+        return _accept_job(vid, False)
+    else:
+        new_entry = _run_within_deadline(vid, False)
+        return process_response(new_entry) if new_entry.report else jsonify()
+
+
+@app.route("/wcloud/<vid>/<int:version>.png", methods=["GET"])
+@cross_origin()
+def rest_return_wcloud(vid: str, version: int):
+    """Route for getting the word-cloud image of the video. version is the
+    time of the report update the image belongs to; the image is cached for
+    long under the current version, and revalidated under any other. The
+    strong ETag is the sha256 digest of the image, which is also its key in
+    the image store.
+    """
+    entry = db.DBM.lookup(vid)
+    report, latest_update = entry.report, entry.latest_update
+    if not report or not report.wcloud:
+        abort(404)
+    etag = _wcloud_hash(report)
+    if not etag:
+        # a legacy image file that is gone, see _format_report
+        abort(404)
+    if _is_legacy_wcloud(report):
+        image = report.wcloud
     else:
-        new_video_meta, new_report = interface.main(vid)
-        db.DBM.add_entry_to_db(vid, new_video_meta, new_report)
-        return process_response(new_report) if new_report else jsonify()
+        data = _images.get(report.wcloud)
+        if data is None:
+            # evicted
+            data = _render_again(vid, report)
+            if data is None:
+                abort(404)
+            etag = blobstore.digest_of(data)
+        image = BytesIO(data)
+    is_current = version == _wcloud_version(latest_update)
+    # send_file answers If-None-Match / If-Modified-Since with 304
+    response = send_file(image, mimetype="image/png", conditional=True,
+                         etag=etag, last_modified=latest_update,
+                         max_age=app.config["WCLOUD_MAX_AGE"] if is_current else 0)
+    response.cache_control.public = True
+    if is_current:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+@app.route("/analysis/batch", methods=["GET", "POST"])
+@cross_origin()
+def rest_return_reports():
+    """Route for getting the reports of many videos, given as a JSON body
+    {"ids": [...]} or as ?ids=id1,id2. Reports are streamed back as
+    newline-delimited JSON, one {"video_id": ..., "report": ...} line per
+    video in the order they complete; cached reports come first.
+    """
+    if request.method == "POST":
+        vids = (request.get_json(silent=True) or {}).get("ids") or []
+    else:
+        vids = request.args.get("ids", "").split(",")
+    # drop empty and repeated ids, keep the order
+    vids = list(dict.fromkeys(vid for vid in vids if isinstance(vid, str) and vid))
+    if len(vids) > app.config["BATCH_MAX_IDS"]:
+        return jsonify(error=f"at most {app.config['BATCH_MAX_IDS']} ids per batch"), 413
+
+    def stream():
+        entries = db.DBM.select_entries_from_db(vids)
+        misses = []
+        for vid in vids:
+            if vid not in entries:
+                misses.append(vid)
+                continue
+            entry = entries[vid]
+            if not entry.report:
+                yield _batch_line(vid, None)
+            elif entry.expired:
+                misses.append(vid)
+            else:
+                if entry.report.partial:
+                    _complete_later(vid)
+                yield _batch_line(vid, entry)
+        if not misses:
+            return
+
+        try:
+            with quota.priority(quota.BULK):
+                metas, failed = utils.videos_meta_by_ids(misses)
+        except quota.QuotaExceeded as e:
+            for vid in misses:
+                yield _batch_line(vid, None, str(e))
+            return
+        futures = {}
+        for vid in misses:
+            if vid in failed:
+                # not known to be invalid, the next request asks again
+                yield _batch_line(vid, None, str(failed[vid]))
+            elif vid in metas:
+                future = _batch_pool.submit(_in_app_context, _run_within_deadline, vid, vid in entries,
+                                            metas[vid], level=quota.BULK)
+                futures[future] = vid
+            else:
+                if vid not in entries:
+                    # means the id is not valid, record it like a single request does
+                    db.DBM.add_entry_to_db(vid, None, None)
+                yield _batch_line(vid, None)
+        for future in as_completed(futures):
+            try:
+                yield _batch_line(futures[future], future.result())
+            except Exception as e:
+                # TODO: logging
+                print(e)
+                yield _batch_line(futures[future], None, str(e))
+
+    return Response(stream_with_context(stream()), mimetype="application/x-ndjson")
+
+
+def _batch_line(vid: str, result: Optional[db.ReportLookup], error: str = None) -> str:
+    """Helper function to format one line of the batch response."""
+    line = {"video_id": vid, "report": _format_result(result)}
+    if error:
+        line["error"] = error
+    return json.dumps(line) + "\n"
+
+
+@app.route("/stats", methods=["GET"])
+@cross_origin()
+def rest_return_stats():
+    """Route for getting the counters of the server."""
+    return jsonify(singleflight=_in_flight.stats(), jobs=_jobs.stats(),
+                   responses=_responses.stats(), db=db.stats(), refresher=_refresher.stats(),
+                   images=_images.stats(), renderer=_renderer.stats(), youtube=utils.youtube_stats(),
+                   analyzer=utils.analyzer_stats(), quota=utils.quota_stats())
+
+
+@app.errorhandler(quota.QuotaExceeded)
+def handle_quota_exceeded(e: quota.QuotaExceeded):
+    """Answer a request whose upstream call was shed with 503, and with when
+    the quota allows it again."""
+    response = jsonify(error=str(e))
+    response.status_code = 503
+    response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+    return response
+
+
+@app.errorhandler(HttpError)
+def handle_upstream_error(e: HttpError):
+    """Answer a request whose comments could not be fetched with 502; the
+    next request tries again."""
+    response = jsonify(error=str(e))
+    response.status_code = 502
+    return response
 
 
-def process_response(report: datatypes.Report):
-    """Helper function to format json file as response."""
-    # encode image to base64 string
+@app.route("/jobs/<job_id>", methods=["GET"])
+@cross_origin()
+def rest_return_job(job_id: str):
+    """Route for polling a report job. Returns the report once the job is
+    done, and 202 with the status of the job while it is still running.
+    """
+    job = _jobs.get(job_id)
+    if not job:
+        return jsonify(), 404
+    response = job.to_dict()
+    if job.status == DONE:
+        response["report"] = _format_result(job.result)
+        return jsonify(**response)
+    elif job.status == FAILED:
+        return jsonify(**response), 500
+    else:
+        return jsonify(**response), 202
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+@cross_origin()
+def rest_stream_job(job_id: str):
+    """Route for following a report job as server-sent events. One "stage"
+    event is sent per pipeline stage, followed by a final "done" event
+    carrying the report or a "failed" event carrying the error.
+    """
+    job = _jobs.get(job_id)
+    if not job:
+        return jsonify(), 404
+    keepalive = app.config["JOB_EVENTS_KEEPALIVE"]
+
+    def stream():
+        seen = 0
+        while True:
+            events, finished = job.wait_events(seen, keepalive)
+            seen += len(events)
+            for event, data in events:
+                if event == DONE:
+                    data = dict(data, report=_format_result(job.result))
+                elif event == FAILED:
+                    data = dict(data, error=job.error)
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            if finished:
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _can_serve_stale(entry: db.ReportLookup) -> bool:
+    """Helper function to tell whether the expired report of the video may
+    be served while it is refreshed."""
+    if not app.config["STALE_WHILE_REVALIDATE"]:
+        return False
+    return entry.age().total_seconds() <= app.config["MAX_STALENESS_SECONDS"]
+
+
+def _serve_stale(vid: str, entry: db.ReportLookup):
+    """Helper function to answer with the expired report, flagged as stale
+    with its age, and to schedule one background refresh of the video.
+    """
+    try:
+        # a refresh that is already running for this video is reused
+        _jobs.submit(vid, vid, True, quota.BACKGROUND)
+    except JobQueueFull as e:
+        # the next request will try again
+        print(e)
+    age = int(entry.age().total_seconds())
+    response = jsonify(stale=True, age=age, **_format_report(entry.report, entry.latest_update))
+    response.headers["Age"] = str(age)
+    response.headers["Warning"] = '110 - "Response is Stale"'
+    return response
+
+
+def _job_mode() -> bool:
+    """Helper function to tell whether the current request runs in job mode."""
+    return request.args.get("mode", app.config["REPORT_MODE"]) == "job"
+
+
+def _accept_job(vid: str, exists: bool):
+    """Helper function to schedule the analysis of the video and to answer
+    with 202 and where to follow the job.
+    """
+    try:
+        job = _jobs.submit(vid, vid, exists)
+    except JobQueueFull as e:
+        return jsonify(error=str(e)), 503
+    response = jsonify(job_id=job.job_id, status=job.status,
+                       poll=url_for("rest_return_job", job_id=job.job_id),
+                       events=url_for("rest_stream_job", job_id=job.job_id))
+    response.status_code = 202
+    response.headers["Location"] = url_for("rest_return_job", job_id=job.job_id)
+    return response
+
+
+def _run_within_deadline(vid: str, exists: bool, meta=None) -> db.ReportLookup:
+    """Helper function to run the pipeline of a request within
+    REPORT_DEADLINE_SECONDS. A partial report is returned as it is, and
+    completed by a background job.
+    """
+    deadline = datatypes.Deadline(app.config["REPORT_DEADLINE_SECONDS"])
+    entry = _in_flight.do(vid, _run_pipeline, vid, exists, None, meta, deadline)
+    if entry.report and entry.report.partial:
+        _complete_later(vid)
+    return entry
+
+
+def _complete_later(vid: str) -> None:
+    """Helper function to schedule the background job completing the
+    partial report of the video; a job already running for it is reused."""
+    try:
+        _jobs.submit(vid, vid, True, quota.BACKGROUND)
+    except JobQueueFull as e:
+        # the next request will try again
+        print(e)
+
+
+def _run_pipeline(vid: str, exists: bool, progress=None, meta=None,
+                  deadline: Optional[datatypes.Deadline] = None) -> db.ReportLookup:
+    """Helper function to run the analysis of the video and to write the
+    result to the database. Returns the new entry. Only one call per video
+    id runs at a time; the concurrent requests share its result through
+    _in_flight. The pipeline of a job has no deadline.
+    """
+    previous_video = previous_report = None
+    if exists and app.config["INCREMENTAL_REFRESH"]:
+        previous_video = db.DBM.select_video_meta(vid)
+        previous_report = db.DBM.select_report_from_db(vid)
+    new_video_meta, new_report = interface.main(vid, progress, meta, budget=app.config["COMMENT_BUDGET"],
+                                                timeout=app.config["COMMENT_DEADLINE_SECONDS"],
+                                                previous_video=previous_video, previous_report=previous_report,
+                                                deadline=deadline)
+    if progress:
+        progress("saving")
+    if exists:
+        return db.DBM.update_entry(vid, new_video_meta, new_report)
+    else:
+        return db.DBM.add_entry_to_db(vid, new_video_meta, new_report)
+
+
+def process_response(entry: db.ReportLookup):
+    """Helper function to format json file as response. The serialized
+    response is cached for the next requests of the same report version,
+    unless the report is partial, so that the next requests see that it is
+    being completed, or was not stored.
+    """
+    body = (app.json.dumps(_format_report(entry.report, entry.latest_update)) + "\n").encode("utf-8")
+    if entry.report.partial or not entry.stored:
+        return _send_cached(CachedResponse(entry.report._id, entry.latest_update, entry.expires_at, body))
+    return _send_cached(_responses.put(entry.report._id, entry.latest_update, entry.expires_at, body))
+
+
+def _send_cached(cached: CachedResponse):
+    """Helper function to answer with the cached response, compressed as the
+    client accepts it."""
+    body, encoding = cached.encoded(request.accept_encodings)
+    response = Response(body, mimetype="application/json")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def _format_result(result: Optional[db.ReportLookup]) -> dict:
+    """Helper function to format the report of an entry; returns an empty
+    dict for a missing report."""
+    if not result or not result.report:
+        return {}
+    return _format_report(result.report, result.latest_update)
+
+
+def _format_report(report: datatypes.Report, latest_update: datetime) -> dict:
+    """Helper function to format the report as a dict. The word-cloud image
+    is only referenced by its url and hash, see rest_return_wcloud.
+    """
     response = dict()
 
     response["attitude"] = report.attitude
     response["video_title"] = report.video_title
     response["emoji"] = report.emoji
-    if not report.wcloud:
-        response["wcloud"] = None
+    wcloud_hash = _wcloud_hash(report) if report.wcloud else None
+    if not wcloud_hash or not _wcloud_available(report):
+        # no image, a legacy image file that is gone, or an evicted image
+        # that cannot be rendered again: rest_return_wcloud answers 404 for it
+        response["wcloud_url"] = None
+        response["wcloud_hash"] = None
     else:
-        with open(report.wcloud, "rb") as img:
-            b64_img_str = base64.b64encode(img.read()).decode("ascii")
-            response["wcloud"] = b64_img_str
+        response["wcloud_url"] = url_for("rest_return_wcloud", vid=report._id,
+                                         version=_wcloud_version(latest_update))
+        response["wcloud_hash"] = wcloud_hash
     
     response["tags"] = report.tags;
+    if report.partial:
+        response["partial"] = True
+        response["coverage"] = round(report.coverage, 3)
+    if not report.analyzed:
+        # the analyzer does not handle the language of the comments
+        response["analyzed"] = False
+
+    return response
+
+
+
+def start_background() -> None:
+    """Function to start the background work of this process. It is not
+    started on import, so that pre-forked workers start their own."""
+    _renderer.warm_up()
+    if app.config["REFRESHER_ENABLED"]:
+        _refresher.start()
+
+
+def shutdown() -> None:
+    """Function to let the background work of this process finish."""
+    _refresher.stop()
+    _jobs.shutdown()
+    _batch_pool.shutdown()
+    _renderer.shutdown()
+    db.shutdown()
+
+
+def _wcloud_version(latest_update: datetime) -> int:
+    """Helper function to turn the time of a report update into the version
+    used in the url of its word-cloud image."""
+    return int(latest_update.timestamp())
+
+
+def _is_legacy_wcloud(report: datatypes.Report) -> bool:
+    """Helper function to tell whether the report was generated before the
+    image store, when wcloud was the absolute path to a png file."""
+    return os.path.isabs(report.wcloud)
+
+
+def _wcloud_available(report: datatypes.Report) -> bool:
+    """Helper function to tell whether rest_return_wcloud can serve the
+    image of the report: it is in the image store, or it was evicted and
+    can be rendered again from the word frequencies of the report."""
+    return _is_legacy_wcloud(report) or bool(report.word_freq) or report.wcloud in _images
+
+
+def _render_again(vid: str, report: datatypes.Report) -> Optional[bytes]:
+    """Helper function to render the evicted word-cloud image of the report
+    again from its word frequencies, in the font of the language of the
+    video, and to store it. The layout is seeded, so the image is the same
+    as before. Returns the image, or None for a report without word
+    frequencies or if the render fails."""
+    if not report.word_freq:
+        return None
+    video = db.DBM.select_video_meta(vid)
+    data = _renderer.render(report.word_freq, video.lang if video else None)
+    if data is not None:
+        _images.put(data)
+    return data
+
 
-    return jsonify(**response)
+def _wcloud_hash(report: datatypes.Report) -> Optional[str]:
+    """Helper function to get the digest of the word-cloud image; reports
+    generated before the digest was stored get it computed from the file,
+    or None if the file cannot be read."""
+    if report.wcloud_hash:
+        return report.wcloud_hash
+    if not _is_legacy_wcloud(report):
+        return report.wcloud
+    try:
+        return utils.file_digest(report.wcloud)
+    except OSError as e:
+        # TODO: logging
+        print(e)
+        return None
 
 
 if __name__ == "__main__":
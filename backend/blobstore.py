@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Emotional-YouTube Content-addressed Image Store
+Jan(Zhan) Lu and Haoyan Wang, Winter 2020
+
+This code is provided for non-commercial and study purpose.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, should conform to the open source licence as provided.
+
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+
+DEFAULT_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..", "dat", "wcloud.sqlite")
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# bytes of the database file mapped into memory; reads go through the map
+MMAP_SIZE = 256 * 1024 * 1024
+# the access time of a blob is only written again after this many seconds
+ACCESS_RESOLUTION = 60
+# blobs deleted per eviction round
+EVICTION_BATCH = 64
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, data BLOB NOT NULL, "
+    "size INTEGER NOT NULL, last_access REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_blobs_last_access ON blobs (last_access)",
+    "CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO usage VALUES (0, 0)"
+]
+
+
+def digest_of(data: bytes) -> str:
+    """Function returns the key of data in the store."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore:
+    """Store of immutable blobs keyed by the sha256 digest of their content,
+    kept in a SQLite table. Identical images are stored once. When the blobs
+    take more than max_bytes, the least recently used ones are evicted and
+    their pages are returned to the file system. The database file is memory
+    mapped, so reads are served from the page cache without read calls.
+
+    === Attributes ===
+    path     : path to the database file;
+    max_bytes: upper bound of the bytes of all the blobs.
+    """
+
+    path: str
+    max_bytes: int
+
+    def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return the connection of this thread; a forked process opens its own."""
+        connection = getattr(self._local, "connection", None)
+        if connection and self._local.pid == os.getpid():
+            return connection
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        # IMPORTANT: auto_vacuum must be set before the tables are created
+        connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        for statement in _SCHEMA:
+            connection.execute(statement)
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        return connection
+
+    def put(self, data: bytes) -> str:
+        """Store data and return its digest."""
+        digest = digest_of(data)
+        connection = self._connection()
+        with _transaction(connection):
+            inserted = connection.execute(
+                "INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?)",
+                (digest, sqlite3.Binary(data), len(data), time.time())).rowcount
+            if inserted:
+                connection.execute("UPDATE usage SET bytes = bytes + ? WHERE id = 0", (len(data),))
+            else:
+                connection.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (time.time(), digest))
+        self._evict(connection)
+        return digest
+
+    def get(self, digest: str) -> Optional[bytes]:
+        """Return the blob with the digest, or None if it is not stored."""
+        connection = self._connection()
+        row = connection.execute("SELECT data, last_access FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        if not row:
+            self._misses += 1
+            return None
+        self._hits += 1
+        now = time.time()
+        if now - row[1] > ACCESS_RESOLUTION:
+            connection.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (now, digest))
+        return bytes(row[0])
+
+    def __contains__(self, digest: str) -> bool:
+        row = self._connection().execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        return row is not None
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        """Delete the least recently used blobs until they fit in max_bytes."""
+        evicted = 0
+        while True:
+            with _transaction(connection):
+                used = connection.execute("SELECT bytes FROM usage WHERE id = 0").fetchone()[0]
+                if used <= self.max_bytes:
+                    break
+                rows = connection.execute("SELECT digest, size FROM blobs ORDER BY last_access LIMIT ?",
+                                          (EVICTION_BATCH,)).fetchall()
+                if not rows:
+                    break
+                connection.executemany("DELETE FROM blobs WHERE digest = ?", [(row[0],) for row in rows])
+                connection.execute("UPDATE usage SET bytes = bytes - ? WHERE id = 0",
+                                   (sum(row[1] for row in rows),))
+                evicted += len(rows)
+        if evicted:
+            self._evictions += evicted
+            # hand the free pages back so the file stays bounded too
+            connection.execute("PRAGMA incremental_vacuum")
+
+    def stats(self) -> dict:
+        connection = self._connection()
+        used = connection.execute("SELECT bytes FROM usage WHERE id = 0").fetchone()[0]
+        count = connection.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+        total = self._hits + self._misses
+        return {
+            "blobs": count,
+            "bytes": used,
+            "max_bytes": self.max_bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / total if total else 0.0,
+            "evictions": self._evictions
+        }
+
+
+class _transaction:
+    """Context manager running the statements of a connection in autocommit
+    mode inside one immediate transaction."""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+# store used by the word-cloud generation, see configure()
+_store: Optional[BlobStore] = None
+
+
+def configure(path: str = DEFAULT_PATH, max_bytes: int = DEFAULT_MAX_BYTES) -> BlobStore:
+    """Function to set up the store of the word-cloud images."""
+    global _store
+    _store = BlobStore(path, max_bytes)
+    return _store
+
+
+def default_store() -> BlobStore:
+    """Function returns the store of the word-cloud images."""
+    return _store or configure()
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+Emotional-YouTube Tiered Cache of Report Entries
+Jan(Zhan) Lu and Haoyan Wang, Winter 2020
+
+This code is provided for non-commercial and study purpose.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, should conform to the open source licence as provided.
+
+"""
+
+import os
+import time
+import pickle
+import socket
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+from typing import Dict, List, Optional, Tuple
+
+# seconds a network tier is skipped after a failed call
+RETRY_SECONDS = 5
+
+
+class CacheTier:
+    """Abstract class of a tier of the cache. A tier maps a video id to the
+    dict of the columns of its entry, and counts its own hits and misses.
+
+    === Attributes ===
+    name: name of the tier in the stats.
+    """
+
+    name: str
+
+    def __init__(self, name: str):
+        self.name = name
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._errors = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the entry of key, or None."""
+        raise NotImplementedError
+
+    def get_many(self, keys: List[str]) -> Dict[str, dict]:
+        """Return the entries of the keys found in the tier."""
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def put(self, key: str, value: dict) -> bool:
+        """Store the entry of key; returns whether it was stored."""
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        """Drop the entry of key."""
+        raise NotImplementedError
+
+    def _count(self, found: int, asked: int = 1) -> None:
+        self._hits += found
+        self._misses += asked - found
+
+    def stats(self) -> dict:
+        total = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / total if total else 0.0,
+            "writes": self._writes,
+            "errors": self._errors
+        }
+
+
+class MemoryTier(CacheTier):
+    """Tier keeping the max_entries most recently used entries in the memory
+    of the process. Entries are dropped after ttl seconds, which bounds how
+    long a process may miss the writes of other processes.
+
+    === Attributes ===
+    max_entries: maximum number of entries kept;
+    ttl        : seconds an entry is kept.
+    """
+
+    max_entries: int
+    ttl: float
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 60):
+        super().__init__("memory")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item and item[0] < time.monotonic():
+                del self._entries[key]
+                item = None
+            if item:
+                self._entries.move_to_end(key)
+        self._count(item is not None)
+        return item[1] if item else None
+
+    def put(self, key: str, value: dict) -> bool:
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._writes += 1
+        return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+        return dict(super().stats(), entries=entries)
+
+
+class RedisError(Exception):
+    """Error reply of a Redis server."""
+    pass
+
+
+class RedisTier(CacheTier):
+    """Tier shared by hosts, kept in a server speaking the Redis protocol
+    (RESP), e.g. redis://:password@host:6379/0. Entries are pickled and
+    expire after ttl seconds. A failing server is treated as a miss and
+    skipped for RETRY_SECONDS, so that it never fails a request.
+
+    === Attributes ===
+    url    : url of the server;
+    ttl    : seconds an entry is kept;
+    prefix : prefix of the keys;
+    timeout: socket timeout in seconds.
+    """
+
+    url: str
+    ttl: int
+    prefix: str
+    timeout: float
+
+    def __init__(self, url: str, ttl: int = 24 * 3600, prefix: str = "eyt:report:", timeout: float = 0.25):
+        super().__init__("redis")
+        self.url = url
+        self.ttl = ttl
+        self.prefix = prefix
+        self.timeout = timeout
+        parsed = urlparse(url)
+        self._address = (parsed.hostname or "localhost", parsed.port or 6379)
+        self._password = parsed.password
+        self._database = int(parsed.path.lstrip("/") or 0)
+        self._local = threading.local()
+        self._down_until = 0.0
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: List[str]) -> Dict[str, dict]:
+        if not keys:
+            return {}
+        values = self._call("MGET", *[self.prefix + key for key in keys])
+        found = {key: pickle.loads(value) for key, value in zip(keys, values or []) if value is not None}
+        self._count(len(found), len(keys))
+        return found
+
+    def put(self, key: str, value: dict) -> bool:
+        if self._call("SET", self.prefix + key, pickle.dumps(value), "EX", self.ttl) is None:
+            return False
+        self._writes += 1
+        return True
+
+    def delete(self, key: str) -> None:
+        self._call("DEL", self.prefix + key)
+
+    def _call(self, *args):
+        """Send one command and return its reply, or None if the server
+        failed."""
+        if time.monotonic() < self._down_until:
+            return None
+        try:
+            sock, reader = self._connection()
+            sock.sendall(_encode(args))
+            return _read_reply(reader)
+        except (OSError, RedisError, ValueError) as e:
+            # TODO: logging
+            print(f"Redis tier {self.url} failed: {e}")
+            self._errors += 1
+            self._down_until = time.monotonic() + RETRY_SECONDS
+            self._close()
+            return None
+
+    def _connection(self):
+        """Return the connection of this thread; a forked process opens its own."""
+        connection = getattr(self._local, "connection", None)
+        if connection and self._local.pid == os.getpid():
+            return connection
+        sock = socket.create_connection(self._address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = (sock, sock.makefile("rb"))
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        if self._password:
+            self._call_on(connection, "AUTH", self._password)
+        if self._database:
+            self._call_on(connection, "SELECT", self._database)
+        return connection
+
+    @staticmethod
+    def _call_on(connection, *args):
+        connection[0].sendall(_encode(args))
+        return _read_reply(connection[1])
+
+    def _close(self) -> None:
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection:
+            try:
+                connection[1].close()
+                connection[0].close()
+            except OSError:
+                pass
+
+
+def _encode(args) -> bytes:
+    """Helper function to encode a command as a RESP array of bulk strings."""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def _read_reply(reader):
+    """Helper function to read one RESP reply."""
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("connection closed")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        raise RedisError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        if len(data) != length + 2:
+            raise ConnectionError("connection closed")
+        return data[:-2]
+    if kind == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [_read_reply(reader) for _ in range(length)]
+    raise ValueError(f"unexpected reply {line!r}")
+
+
+class TieredCache:
+    """Cache made of tiers ordered from the fastest to the backing one. Reads
+    fall through the tiers and promote what they find into the faster tiers;
+    writes go through every tier, the backing one first, and stop there if
+    the backing tier fails, so that the faster tiers never hold an entry
+    that is not stored.
+
+    === Attributes ===
+    tiers       : the tiers, fastest first, the backing tier last;
+    backing_only: keys of the entries written to the backing tier only.
+    """
+
+    tiers: List[CacheTier]
+    backing_only: Tuple[str, ...]
+
+    def __init__(self, tiers: List[CacheTier], backing_only: Tuple[str, ...] = ()):
+        self.tiers = tiers
+        self.backing_only = backing_only
+
+    def get(self, key: str) -> Optional[dict]:
+        for index, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not None:
+                for faster in self.tiers[:index]:
+                    faster.put(key, value)
+                return value
+        return None
+
+    def get_many(self, keys: List[str]) -> Dict[str, dict]:
+        found = {}
+        missing = list(keys)
+        for index, tier in enumerate(self.tiers):
+            if not missing:
+                break
+            values = tier.get_many(missing)
+            for key, value in values.items():
+                for faster in self.tiers[:index]:
+                    faster.put(key, value)
+            found.update(values)
+            missing = [key for key in missing if key not in values]
+        return found
+
+    def put(self, key: str, value: dict) -> bool:
+        """Write the entry of key through the tiers; returns whether the
+        backing tier stored it."""
+        if not self.tiers[-1].put(key, value):
+            return False
+        value = {column: value[column] for column in value if column not in self.backing_only}
+        for tier in reversed(self.tiers[:-1]):
+            tier.put(key, value)
+        return True
+
+    def delete(self, key: str) -> None:
+        for tier in self.tiers:
+            tier.delete(key)
+
+    def evict(self, key: str) -> None:
+        """Drop the entry of key from the faster tiers only, e.g. when the
+        backing tier failed to store it after all."""
+        for tier in self.tiers[:-1]:
+            tier.delete(key)
+
+    def stats(self) -> dict:
+        return {tier.name: tier.stats() for tier in self.tiers}
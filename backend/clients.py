@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Emotional-YouTube Long-lived API Clients
+Jan(Zhan) Lu and Haoyan Wang, Winter 2020
+
+This code is provided for non-commercial and study purpose.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, should conform to the open source licence as provided.
+
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+from google.cloud.language_v1 import LanguageServiceClient
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document, Resource
+from googleapiclient.http import HttpRequest, build_http
+
+YOUTUBE_SERVICE_NAME = "youtube"
+YOUTUBE_API_VERSION = "v3"
+# discovery document shipped with the data files; when it is missing, the
+# one bundled with google-api-python-client is used, so that building the
+# client never fetches the document
+DISCOVERY_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..", "dat",
+                              f"{YOUTUBE_SERVICE_NAME}.{YOUTUBE_API_VERSION}.json")
+# idle transports kept for reuse
+POOL_SIZE = 16
+# Natural Language API clients, each with its own gRPC channel
+LANGUAGE_POOL_SIZE = 4
+
+
+class ClientManager:
+    """Process-wide YouTube Data API client. The resource is built once from
+    a local discovery document, and the requests are executed on a pool of
+    keep-alive http transports, each lent to one thread at a time since
+    httplib2 is not thread-safe. The pool is emptied in a forked process.
+
+    === Attributes ===
+    endpoint : root url of the API, e.g. of a local stand-in server, or None
+               for the default one;
+    pool_size: maximum number of idle transports kept.
+    """
+
+    endpoint: Optional[str]
+    pool_size: int
+
+    def __init__(self, developer_key: str, endpoint: Optional[str] = None, pool_size: int = POOL_SIZE,
+                 discovery_path: str = DISCOVERY_PATH):
+        self.endpoint = endpoint
+        self.pool_size = pool_size
+        self._developer_key = developer_key
+        self._discovery_path = discovery_path
+        self._lock = threading.Lock()
+        self._resource = None
+        self._idle: List = []
+        self._created = 0
+        self._requests = 0
+        self._reused = 0
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def youtube(self) -> Resource:
+        """Return the YouTube resource, built on the first call."""
+        if self._resource is None:
+            with self._lock:
+                if self._resource is None:
+                    client_options = {"api_endpoint": self.endpoint} if self.endpoint else None
+                    # the transport of the resource is never used, see execute()
+                    self._resource = build_from_document(self._discovery_document(),
+                                                         developerKey=self._developer_key,
+                                                         http=build_http(), client_options=client_options)
+        return self._resource
+
+    def _discovery_document(self) -> str:
+        if os.path.isfile(self._discovery_path):
+            with open(self._discovery_path) as file:
+                return file.read()
+        document = discovery_cache.get_static_doc(YOUTUBE_SERVICE_NAME, YOUTUBE_API_VERSION)
+        if not document:
+            raise FileNotFoundError(f"No discovery document of {YOUTUBE_SERVICE_NAME} {YOUTUBE_API_VERSION}")
+        return document
+
+    @contextmanager
+    def http(self):
+        """Lend an http transport of the pool to the calling thread."""
+        with self._lock:
+            transport = self._idle.pop() if self._idle else None
+            if transport is None:
+                self._created += 1
+        if transport is None:
+            transport = build_http()
+        try:
+            yield transport
+        finally:
+            with self._lock:
+                if len(self._idle) < self.pool_size:
+                    self._idle.append(transport)
+
+    def execute(self, request: HttpRequest):
+        """Execute the request on a pooled transport and return its response."""
+        with self.http() as transport:
+            reused = any(getattr(connection, "sock", None) for connection in transport.connections.values())
+            with self._lock:
+                self._requests += 1
+                self._reused += reused
+            return request.execute(http=transport)
+
+    def warm_up(self) -> None:
+        """Build the resource, and the transports of the pool."""
+        self.youtube()
+        with self._lock:
+            missing = self.pool_size - len(self._idle)
+            self._created += missing
+            self._idle.extend(build_http() for _ in range(missing))
+
+    def _after_fork(self) -> None:
+        # the connections of the parent must not be shared
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "built": self._resource is not None,
+                "endpoint": self.endpoint,
+                "transports_created": self._created,
+                "transports_idle": len(self._idle),
+                "requests": self._requests,
+                "connections_reused": self._reused,
+                "reuse_ratio": self._reused / self._requests if self._requests else 0.0
+            }
+
+
+class LanguageClientPool:
+    """Process-wide pool of Natural Language API clients, handed out in turns.
+    A client is thread-safe and keeps its gRPC channel open, so it is reused
+    by every report; several channels spread the concurrent calls. Clients
+    are created on first use, since gRPC channels do not survive a fork.
+
+    === Attributes ===
+    size: number of clients.
+    """
+
+    size: int
+
+    def __init__(self, size: int = LANGUAGE_POOL_SIZE):
+        self.size = size
+        self._lock = threading.Lock()
+        self._clients: List[LanguageServiceClient] = []
+        self._pid = os.getpid()
+        self._next = 0
+        self._calls = 0
+
+    def get(self) -> LanguageServiceClient:
+        """Return the next client of the pool."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._clients = []
+                self._pid = os.getpid()
+            if len(self._clients) < self.size:
+                self._clients.append(LanguageServiceClient())
+                client = self._clients[-1]
+            else:
+                client = self._clients[self._next % self.size]
+                self._next += 1
+            self._calls += 1
+            return client
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"clients": len(self._clients), "size": self.size, "calls": self._calls}
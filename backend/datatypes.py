@@ -10,7 +10,10 @@ any changes, should conform to the open source licence as provided.
 4
 """
 
-from typing import List
+import time
+import numpy as np
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
 
 
 class Video:
@@ -23,7 +26,12 @@ class Video:
     channel_title: title of this video's channel;
     tags         : list of tags of this video;
     comments     : comments of this video;
-    lang         : language of the majority of comments
+    comment_ids  : YouTube ids of the comments, in the same order;
+    lang         : language of the majority of comments;
+    lang_distribution: share of the sampled comments in each language, the
+                   dominant one first;
+    published_at : time (UTC) at which the video was published;
+    comment_count: number of comments of the video reported by YouTube
     """
 
     _id        : str
@@ -33,9 +41,15 @@ class Video:
     channel_id : str
     channel_title: str
     comments   : List[str]
+    # class-level defaults for videos pickled before the attributes existed
+    published_at : datetime = None
+    comment_count: int = None
+    comment_ids  : List[str] = None
+    lang_distribution: Dict[str, float] = None
 
     def __init__(self, **kwargs):
-        valid_keys = ["_id", "video_title", "channel_id", "channel_title", "tags", "comments", "lang"]
+        valid_keys = ["_id", "video_title", "channel_id", "channel_title", "tags", "comments", "lang",
+                      "published_at", "comment_count", "comment_ids", "lang_distribution"]
 
         for key in valid_keys:
             self.__dict__[key] = kwargs.get(key)
@@ -56,8 +70,20 @@ class Report:
     video_title: title of video;
     attitude: the attitude of viewers;
     emoji: emoji repr of the attitude;
-    wcloud: absolute path to where the image of word-cloud is stored;
-    tags: list of tags of video.
+    wcloud: sha256 hex digest under which the word-cloud image is kept in
+            the image store; reports generated before the store hold the
+            absolute path to the image file instead;
+    wcloud_hash: sha256 hex digest of the word-cloud image;
+    tags: list of tags of video;
+    cache_hit_rate: share of the distinct comments whose analysis was found
+                    in the comment analysis cache;
+    partial: whether the deadline of the request cut the report short, so
+             that it is completed later;
+    coverage: share of the comments of a full report that were analyzed;
+    analyzed: False if the analyzer does not handle the language of the
+              comments, which were left without sentiment;
+    word_freq: number of times each adjective lemma occurs in the comments,
+               most frequent first, which the word cloud is rendered from.
     """
 
     _id: str
@@ -65,18 +91,171 @@ class Report:
     attitude: str
     emoji: str
     wcloud: str
+    # class-level default for reports pickled before the attribute existed
+    wcloud_hash: str = None
     tags: List[str]
+    cache_hit_rate: float = None
+    partial: bool = False
+    coverage: float = 1.0
+    analyzed: bool = True
+    word_freq: Dict[str, int] = None
 
     def __init__(self, **kwargs):
         for k, v in kwargs.items():
             # add tags and most mentioned words
-            if k in ["_id", "video_title", "attitude", "emoji", "wcloud", "tags"]:
+            if k in ["_id", "video_title", "attitude", "emoji", "wcloud", "wcloud_hash", "tags",
+                     "cache_hit_rate", "partial", "coverage", "analyzed", "word_freq"]:
                 self.__dict__[k] = v
 
     def __str__(self) -> str:
         return f"Video {self.video_title} (id: {self._id}) received {self.attitude}, which is {self.emoji}."
 
 
+class CommentAnalysis:
+    """Class to store the result of the analysis of one comment.
+
+    === Attributes ===
+    score     : mean sentiment score of the sentences of the comment;
+    magnitude : sum of the sentiment magnitudes of the sentences;
+    sentences : number of sentences of the comment;
+    adjectives: lemmas of the adjectives of the comment, in order;
+    analyzer  : name of the analyzer that produced the analysis, or None if
+                it was loaded from the cache.
+    """
+
+    score     : float
+    magnitude : float
+    sentences : int
+    adjectives: List[str]
+    analyzer  : str
+
+    def __init__(self, score: float = 0.0, magnitude: float = 0.0, sentences: int = 0,
+                 adjectives: List[str] = None, analyzer: str = None):
+        self.score = score
+        self.magnitude = magnitude
+        self.sentences = sentences
+        self.adjectives = adjectives if adjectives is not None else []
+        self.analyzer = analyzer
+
+    def add_sentence(self, score: float, magnitude: float) -> None:
+        self.sentences += 1
+        self.score += (score - self.score) / self.sentences
+        self.magnitude += magnitude
+
+
+class ReportAggregate:
+    """Class to aggregate the analyses of the comments of a report one at a
+    time, as one document, so that the analyses need not be kept. The score
+    of the document is the mean score of the comments with a sentence,
+    each weighted by its words times its magnitude, plus NEUTRAL_MAGNITUDE
+    so that the neutral comments count too.
+
+    === Attributes ===
+    comments  : number of comments aggregated;
+    words     : number of words of these comments;
+    sentences : number of their sentences;
+    score_sum : sum of the weighted scores of the comments;
+    weight    : sum of the weights of the comments;
+    magnitude : sum of the magnitudes of their sentences;
+    adjectives: lemmas of the adjectives of these comments;
+    distinct  : number of distinct comments looked up in the comment
+                analysis cache;
+    cached    : number of those found in the cache;
+    unsupported: number of comments left out because the analyzer does not
+                 handle their language.
+    """
+
+    # weight of a comment without sentiment, per word, relative to magnitude
+    NEUTRAL_MAGNITUDE = 0.25
+
+    comments  : int
+    words     : int
+    sentences : int
+    score_sum : float
+    weight    : float
+    magnitude : float
+    adjectives: List[str]
+    distinct  : int
+    cached    : int
+    unsupported: int
+
+    def __init__(self):
+        self.comments = 0
+        self.words = 0
+        self.sentences = 0
+        self.score_sum = 0.0
+        self.weight = 0.0
+        self.magnitude = 0.0
+        self.adjectives = []
+        self.distinct = 0
+        self.cached = 0
+        self.unsupported = 0
+
+    def add(self, comment: str, analysis: CommentAnalysis) -> None:
+        words = comment.count(" ") + 1
+        self.comments += 1
+        self.words += words
+        self.sentences += analysis.sentences
+        self.magnitude += analysis.magnitude
+        self.adjectives.extend(analysis.adjectives)
+        if analysis.sentences:
+            weight = words * (analysis.magnitude + self.NEUTRAL_MAGNITUDE)
+            self.score_sum += analysis.score * weight
+            self.weight += weight
+
+    def score(self) -> Optional[float]:
+        """Return the weighted mean score of the comments, or None if there
+        is no sentence."""
+        return self.score_sum / self.weight if self.weight else None
+
+    def word_freq(self, stopwords: Iterable[str] = (), max_words: Optional[int] = None) -> Dict[str, int]:
+        """Return the number of times each adjective occurs, most frequent
+        first, at most max_words of them. The lemmas are lower-cased and
+        counted at once over all the adjectives; stopwords are left out."""
+        if not self.adjectives:
+            return {}
+        lemmas, counts = np.unique(np.char.lower(np.array(self.adjectives)), return_counts=True)
+        keep = ~np.isin(lemmas, list(stopwords))
+        lemmas, counts = lemmas[keep], counts[keep]
+        order = np.argsort(-counts, kind="stable")[:max_words]
+        return dict(zip(lemmas[order].tolist(), counts[order].tolist()))
+
+    def hit_rate(self) -> float:
+        return self.cached / self.distinct if self.distinct else 0.0
+
+
+class Deadline:
+    """Deadline by which a report must be returned, carried through fetching,
+    analysis and rendering. The stages it cuts short are recorded.
+
+    === Attributes ===
+    seconds: seconds given to the report;
+    skipped: names of the stages cut short.
+    """
+
+    seconds: float
+    skipped: List[str]
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.skipped = []
+        self._at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """Return the seconds left, at least 0."""
+        return max(self._at - time.monotonic(), 0.0)
+
+    def until(self, seconds: float, reserve: float = 0.0) -> float:
+        """Return the seconds a stage may take, at most seconds, leaving
+        reserve seconds to the stages after it."""
+        return max(min(seconds, self.remaining() - reserve), 0.0)
+
+    def skip(self, stage: str) -> None:
+        """Record that the stage was cut short."""
+        if stage not in self.skipped:
+            self.skipped.append(stage)
+
+
 class UrlError(Exception):
     """Exception class for URL error
 
@@ -10,12 +10,45 @@ any changes, should conform to the open source licence as provided.
 
 """
 
-from sqlalchemy import exc
+import atexit
+from sqlalchemy import event, exc, func, inspect, or_, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from . import cache
 from . import datatypes
+from . import ttl
+from .writebehind import WriteBehind
 from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
 from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
 
+# expiry of the reports stored before their expiry was computed per video
+REPORT_TTL = ttl.DEFAULT_TTL
+
+# storage modes: "sync" commits every write in the request; "write-behind"
+# switches SQLite to WAL and commits writes in batches on a writer thread
+SYNC = "sync"
+WRITE_BEHIND = "write-behind"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    # negative: size in KiB
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000
+}
+
+
+# bound of the cached comment analyses, checked every
+# COMMENT_CACHE_EVICTION_INTERVAL added analyses
+COMMENT_CACHE_MAX_ENTRIES = 1000000
+COMMENT_CACHE_EVICTION_INTERVAL = 1000
+# ids per IN clause, below the SQLite limit of variables
+MAX_IDS_PER_QUERY = 500
+
+# columns of an entry kept by the tiers in front of the database
+LOOKUP_COLUMNS = ("report", "latest_update", "comment_count", "expires_at")
+
 
 # init database (must be initialized first before Marshmallow)
 _db = SQLAlchemy()
@@ -27,20 +60,91 @@ class _ReportEntry(_db.Model):
 
     === Attributes ===
     video_id: video id primary key;
-    video_meta: pickled Video object of video meta data;
+    video_meta: pickled Video object of video meta data, with all the
+                comments; deferred, it is only loaded when accessed;
     report: pickled Report object of analysis report;
-    latest_update: latest update for the report.
+    latest_update: latest update for the report;
+    comment_count: comment count of the video at the latest update;
+    expires_at: time at which the report expires, indexed;
+    refresh_failures: background refreshes failed in a row since the
+                      latest update;
+    refresh_after: time before which the report is not refreshed in the
+                   background again, after a failed refresh.
     """
     video_id = _db.Column(_db.String(20), primary_key=True)
-    video_meta = _db.Column(_db.PickleType)
+    video_meta = _db.deferred(_db.Column(_db.PickleType))
     report = _db.Column(_db.PickleType)
     latest_update = _db.Column(_db.DateTime)
+    comment_count = _db.Column(_db.Integer)
+    expires_at = _db.Column(_db.DateTime, index=True)
+    refresh_failures = _db.Column(_db.Integer)
+    refresh_after = _db.Column(_db.DateTime)
 
-    def __init__(self, video_id: str, video_meta: datatypes.Video, report: datatypes.Report, latest_update):
+    def __init__(self, video_id: str, video_meta: datatypes.Video, report: datatypes.Report, latest_update,
+                 comment_count: Optional[int] = None, expires_at: Optional[datetime] = None):
         self.video_id = video_id
         self.video_meta = video_meta
         self.report = report
         self.latest_update = latest_update
+        self.comment_count = comment_count
+        self.expires_at = expires_at
+
+
+class _CommentAnalysisEntry(_db.Model):
+    """Private class represents the cached analysis of a comment.
+
+    === Attributes ===
+    key       : sha256 hex digest of the analyzer and of the normalized text
+                of the comment, primary key;
+    score     : mean sentiment score of the sentences of the comment;
+    magnitude : sum of the sentiment magnitudes of the sentences;
+    sentences : number of sentences;
+    adjectives: pickled list of the adjectives of the comment;
+    last_used : last time the analysis was used, indexed for eviction.
+    """
+    key = _db.Column(_db.String(64), primary_key=True)
+    score = _db.Column(_db.Float)
+    magnitude = _db.Column(_db.Float)
+    sentences = _db.Column(_db.Integer)
+    adjectives = _db.Column(_db.PickleType)
+    last_used = _db.Column(_db.DateTime, index=True)
+
+
+class ReportLookup:
+    """Class represents the result of looking up the report of a video.
+
+    === Attributes ===
+    exists       : whether the video has a record;
+    report       : the report of the record; None if there is no record, or
+                   if the video id is recorded as not valid;
+    latest_update: latest update of the record, or None;
+    expires_at   : time at which the report expires, or None;
+    expired      : whether the report is expired;
+    stored       : False for the result of a write that did not reach the
+                   database, which must not be cached.
+    """
+
+    exists: bool
+    report: Optional[datatypes.Report]
+    latest_update: Optional[datetime]
+    expires_at: Optional[datetime]
+    expired: bool
+    stored: bool
+
+    def __init__(self, report: Optional[datatypes.Report] = None, latest_update: Optional[datetime] = None,
+                 expires_at: Optional[datetime] = None, exists: bool = False, stored: bool = True):
+        self.exists = exists
+        self.stored = stored
+        self.report = report
+        self.latest_update = latest_update
+        if exists and not expires_at:
+            expires_at = latest_update + REPORT_TTL
+        self.expires_at = expires_at
+        self.expired = exists and DBM.has_expired(expires_at)
+
+    def age(self) -> timedelta:
+        """Return how long ago the report was updated."""
+        return datetime.utcnow() - self.latest_update
 
 
 # init ma
@@ -57,46 +161,309 @@ class _ReportEntrySchema(_ma.Schema):
 _report_schema = _ReportEntrySchema()
 
 
+class _SQLiteTier(cache.CacheTier):
+    """Private class represents the backing tier of the cache, the database.
+    In write-behind mode, the queued entries are read before the database.
+    """
+
+    def __init__(self):
+        super().__init__("sqlite")
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: List[str]) -> Dict[str, dict]:
+        rows = _db.session.query(_ReportEntry.video_id, *[getattr(_ReportEntry, column) for column in LOOKUP_COLUMNS]) \
+            .filter(_ReportEntry.video_id.in_(keys)).all()
+        found = {row.video_id: {column: getattr(row, column) for column in LOOKUP_COLUMNS} for row in rows}
+        if DBM._writer:
+            for key in keys:
+                pending = DBM._writer.get(key)
+                if pending:
+                    found[key] = {column: pending[column] for column in LOOKUP_COLUMNS}
+        self._count(len(found), len(keys))
+        return found
+
+    def put(self, key: str, value: dict) -> bool:
+        """Write all the columns of the entry, in one transaction or queued."""
+        if DBM._writer:
+            DBM._writer.put(key, value)
+        else:
+            try:
+                DBM._upsert_entries([value])
+            except exc.SQLAlchemyError as e:
+                # TODO logging
+                print(e)
+                self._errors += 1
+                return False
+        self._writes += 1
+        return True
+
+    def delete(self, key: str) -> None:
+        _ReportEntry.query.filter_by(video_id=key).delete(synchronize_session=False)
+        _db.session.commit()
+
+
 class DBM:
     """Database Manager class. Class manages the read and write to the database.
     """
 
+    # functions called with the video id and the update time after each write
+    _write_listeners: List[Callable[[str, datetime], None]] = []
+    # functions called with the video id and the update time of a queued
+    # write that was dropped
+    _drop_listeners: List[Callable[[str, datetime], None]] = []
+    # queue of the writes in write-behind mode
+    _writer: Optional[WriteBehind] = None
+    # tiers of the entries, the database last; see init_db
+    _cache: cache.TieredCache = cache.TieredCache([_SQLiteTier()], backing_only=("video_meta",))
+    # comment analyses added since the last eviction check
+    _comment_writes: int = 0
+    _comment_cache_max_entries: int = COMMENT_CACHE_MAX_ENTRIES
+
+    @staticmethod
+    def add_write_listener(listener: Callable[[str, datetime], None]) -> None:
+        """Function to register a function to call with the video id and the
+        latest_update written after each write of an entry."""
+        DBM._write_listeners.append(listener)
+
+    @staticmethod
+    def _notify_write(vid: str, latest_update: datetime) -> None:
+        for listener in DBM._write_listeners:
+            listener(vid, latest_update)
+
+    @staticmethod
+    def add_drop_listener(listener: Callable[[str, datetime], None]) -> None:
+        """Function to register a function to call with the video id and the
+        latest_update of each write that the write-behind queue dropped."""
+        DBM._drop_listeners.append(listener)
+
+    @staticmethod
+    def _dropped(vid: str, row: dict) -> None:
+        """Helper function to take a write the write-behind queue dropped
+        out of the faster tiers and of the listeners, which saw it queued;
+        the tiers of other processes drop it when it expires."""
+        DBM._cache.evict(vid)
+        for listener in DBM._drop_listeners:
+            listener(vid, row["latest_update"])
+
+    @staticmethod
+    def lookup(vid: str) -> ReportLookup:
+        """Function to look up existence, report and freshness of the video
+        through the tiers of the cache; the database is read with one primary
+        key read at most. The pickled video meta data is not loaded.
+        """
+        row = DBM._cache.get(vid)
+        return DBM._to_lookup(row) if row else ReportLookup()
+
+    @staticmethod
+    def _to_lookup(row: dict) -> ReportLookup:
+        return ReportLookup(row["report"], row["latest_update"], row["expires_at"], exists=True)
+
     @staticmethod
     def select_report_from_db(vid: str) -> datatypes.Report:
         """Function to retrieve the record who has the given video_id.
         """
-        # select by primary key
-        return _ReportEntry.query.filter_by(video_id=vid).first().report
+        return DBM.lookup(vid).report
+
+    @staticmethod
+    def select_video_meta(vid: str) -> Optional[datatypes.Video]:
+        """Function to load the pickled video meta data, with all the
+        comments, of the given video_id."""
+        pending = DBM._writer.get(vid) if DBM._writer else None
+        if pending:
+            return pending["video_meta"]
+        row = _db.session.query(_ReportEntry.video_meta) \
+            .filter(_ReportEntry.video_id == vid).first()
+        return row.video_meta if row else None
+
+    @staticmethod
+    def select_entries_from_db(vids: List[str]) -> Dict[str, ReportLookup]:
+        """Function to retrieve the reports of many videos in one query.
+        Returns a dict from video id to its lookup; ids without a record are
+        left out.
+        """
+        return {vid: DBM._to_lookup(row) for vid, row in DBM._cache.get_many(vids).items()}
+
+    @staticmethod
+    def select_soonest_expiring(limit: int, before: datetime) -> List[str]:
+        """Function to retrieve the ids of at most limit valid videos whose
+        reports expire before the given time, soonest first. Videos whose
+        last refresh failed are left out until their retry time, and for
+        good after ttl.MAX_REFRESH_FAILURES failures in a row."""
+        rows = _db.session.query(_ReportEntry.video_id) \
+            .filter(_ReportEntry.report.isnot(None), _ReportEntry.expires_at <= before,
+                    or_(_ReportEntry.refresh_after.is_(None), _ReportEntry.refresh_after <= datetime.utcnow()),
+                    func.coalesce(_ReportEntry.refresh_failures, 0) < ttl.MAX_REFRESH_FAILURES) \
+            .order_by(_ReportEntry.expires_at).limit(limit).all()
+        return [row.video_id for row in rows]
+
+    @staticmethod
+    def record_refresh_failure(vid: str) -> int:
+        """Function to count a failed background refresh of the video, and to
+        hold its next one back by ttl.retry_delay(). The count is reset by
+        the next write of the entry. Returns the failures in a row."""
+        try:
+            row = _db.session.query(_ReportEntry.refresh_failures) \
+                .filter(_ReportEntry.video_id == vid).first()
+            if not row:
+                return 0
+            failures = (row.refresh_failures or 0) + 1
+            _ReportEntry.query.filter_by(video_id=vid).update(
+                {"refresh_failures": failures, "refresh_after": datetime.utcnow() + ttl.retry_delay(failures)},
+                synchronize_session=False)
+            _db.session.commit()
+        except exc.SQLAlchemyError as e:
+            # TODO logging
+            print(e)
+            _db.session.rollback()
+            return 0
+        return failures
 
     @staticmethod
     def does_exist(vid: str) -> bool:
         """Helper function to check for existence."""
-        res = _ReportEntry.query.filter_by(video_id=vid).first()
-        return True if res else False
+        return DBM.lookup(vid).exists
 
     @staticmethod
     def is_expired(vid: str) -> bool:
         """Function to check whether report is expired or not."""
-        entry = _ReportEntry.query.filter_by(video_id=vid).first()
-        return datetime.utcnow() - entry.latest_update > timedelta(10)
+        return DBM.lookup(vid).expired
+
+    @staticmethod
+    def has_expired(expires_at: datetime) -> bool:
+        """Function to check whether a report that expires at expires_at is
+        expired or not."""
+        return datetime.utcnow() > expires_at
 
     @staticmethod
-    def update_entry(vid, video_meta, report):
-        """Function to update the entry indexed by video_id."""
-        _ReportEntry.query.get(vid).update({video_meta: video_meta, report: report})
+    def update_entry(vid, video_meta, report) -> ReportLookup:
+        """Function to update the entry indexed by video_id in place, without
+        loading it first. Returns the updated entry."""
+        return DBM._write(DBM._new_row(vid, video_meta, report, DBM._previous_stats(vid)))
 
     @staticmethod
-    def add_entry_to_db(vid: str, video_meta: datatypes.Video, report: datatypes.Report) -> None:
-        """Function to add new report entry to database.
+    def add_entry_to_db(vid: str, video_meta: datatypes.Video, report: datatypes.Report) -> ReportLookup:
+        """Function to add new report entry to database. Returns the new
+        entry.
         """
-        new_entry = _ReportEntry(vid, video_meta, report, datetime.utcnow())
-        # update database
-        _db.session.add(new_entry)
+        return DBM._write(DBM._new_row(vid, video_meta, report))
+
+    @staticmethod
+    def _previous_stats(vid: str) -> Tuple[Optional[int], Optional[datetime]]:
+        """Helper function to get the comment count and the time of the
+        previous update of the entry, to measure the comment churn."""
+        row = DBM._cache.get(vid)
+        return (row["comment_count"], row["latest_update"]) if row else (None, None)
+
+    @staticmethod
+    def _new_row(vid: str, video_meta: datatypes.Video, report: datatypes.Report,
+                 previous: Tuple[Optional[int], Optional[datetime]] = (None, None)) -> dict:
+        """Helper function to build the columns of an entry written now, with
+        the expiry computed from the video."""
+        latest_update = datetime.utcnow()
+        expires_at = latest_update + ttl.compute_ttl(video_meta, latest_update, *previous)
+        return {"video_id": vid, "video_meta": video_meta, "report": report,
+                "latest_update": latest_update, "expires_at": expires_at,
+                "comment_count": video_meta.comment_count if video_meta else None,
+                "refresh_failures": 0, "refresh_after": None}
+
+    @staticmethod
+    def _write(row: dict) -> ReportLookup:
+        """Helper function to write the entry through every tier; in
+        write-behind mode the database write is queued, and reads see the
+        queued entry until it is committed. If the database write fails, the
+        other tiers and the listeners are left as they are, and the entry
+        returned is marked as not stored."""
+        if not DBM._cache.put(row["video_id"], row):
+            lookup = DBM._to_lookup(row)
+            lookup.stored = False
+            return lookup
+        DBM._notify_write(row["video_id"], row["latest_update"])
+        return DBM._to_lookup(row)
+
+    @staticmethod
+    def select_comment_analyses(keys: List[str]) -> Dict[str, datatypes.CommentAnalysis]:
+        """Function to retrieve the cached analyses of the comments with the
+        given keys, and to mark them as used. Keys without an analysis are
+        left out."""
+        found = {}
+        now = datetime.utcnow()
         try:
+            for start in range(0, len(keys), MAX_IDS_PER_QUERY):
+                group = keys[start:start + MAX_IDS_PER_QUERY]
+                rows = _CommentAnalysisEntry.query.filter(_CommentAnalysisEntry.key.in_(group)).all()
+                for row in rows:
+                    found[row.key] = datatypes.CommentAnalysis(row.score, row.magnitude, row.sentences,
+                                                               row.adjectives)
+                if rows:
+                    _CommentAnalysisEntry.query.filter(_CommentAnalysisEntry.key.in_([row.key for row in rows])) \
+                        .update({"last_used": now}, synchronize_session=False)
             _db.session.commit()
         except exc.SQLAlchemyError as e:
             # TODO logging
-            pass
+            print(e)
+            _db.session.rollback()
+        return found
+
+    @staticmethod
+    def add_comment_analyses(analyses: Dict[str, datatypes.CommentAnalysis]) -> None:
+        """Function to cache the analyses of comments by their keys; the
+        least recently used ones are evicted beyond the maximum entries."""
+        if not analyses:
+            return
+        now = datetime.utcnow()
+        rows = [{"key": key, "score": analysis.score, "magnitude": analysis.magnitude,
+                 "sentences": analysis.sentences, "adjectives": analysis.adjectives, "last_used": now}
+                for key, analysis in analyses.items()]
+        stmt = sqlite_insert(_CommentAnalysisEntry.__table__).on_conflict_do_nothing(index_elements=["key"])
+        try:
+            _db.session.execute(stmt, rows)
+            _db.session.commit()
+        except exc.SQLAlchemyError as e:
+            # TODO logging
+            print(e)
+            _db.session.rollback()
+            return
+        DBM._comment_writes += len(rows)
+        if DBM._comment_writes >= COMMENT_CACHE_EVICTION_INTERVAL:
+            DBM._comment_writes = 0
+            DBM.evict_comment_analyses(DBM._comment_cache_max_entries)
+
+    @staticmethod
+    def evict_comment_analyses(max_entries: int) -> int:
+        """Function to delete the least recently used comment analyses beyond
+        max_entries. Returns the number deleted."""
+        try:
+            excess = _CommentAnalysisEntry.query.count() - max_entries
+            if excess <= 0:
+                return 0
+            oldest = select(_CommentAnalysisEntry.key).order_by(_CommentAnalysisEntry.last_used).limit(excess)
+            deleted = _CommentAnalysisEntry.query.filter(_CommentAnalysisEntry.key.in_(oldest)) \
+                .delete(synchronize_session=False)
+            _db.session.commit()
+            return deleted
+        except exc.SQLAlchemyError as e:
+            # TODO logging
+            print(e)
+            _db.session.rollback()
+            return 0
+
+    @staticmethod
+    def _upsert_entries(rows: List[dict]) -> None:
+        """Helper function to insert or replace the entries in one transaction."""
+        stmt = sqlite_insert(_ReportEntry.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["video_id"],
+            set_={column: stmt.excluded[column]
+                  for column in ("video_meta", "report", "latest_update", "comment_count", "expires_at",
+                                 "refresh_failures", "refresh_after")})
+        try:
+            _db.session.execute(stmt, rows)
+            _db.session.commit()
+        except exc.SQLAlchemyError:
+            _db.session.rollback()
+            raise
 
 
 def init_db(app):
@@ -108,7 +475,88 @@ def init_db(app):
     _ma.init_app(app)
     # IMPORTANT: bind app to sqlalchemy
     app.app_context().push()
+    if app.config.get("DB_STORAGE_MODE", SYNC) == WRITE_BEHIND:
+        # IMPORTANT: before the first connection is opened
+        event.listen(_db.get_engine(app), "connect", _set_sqlite_pragmas)
+
+        def write(rows):
+            with app.app_context():
+                DBM._upsert_entries(rows)
+
+        DBM._writer = WriteBehind(write, interval=app.config.get("DB_WRITE_INTERVAL", 0.005),
+                                  max_batch=app.config.get("DB_WRITE_MAX_BATCH", 500), on_drop=DBM._dropped)
+        atexit.register(shutdown)
+    tiers = []
+    if app.config.get("CACHE_MEMORY_ENTRIES"):
+        tiers.append(cache.MemoryTier(app.config["CACHE_MEMORY_ENTRIES"],
+                                      app.config.get("CACHE_MEMORY_TTL_SECONDS", 60)))
+    if app.config.get("CACHE_REDIS_URL"):
+        tiers.append(cache.RedisTier(app.config["CACHE_REDIS_URL"],
+                                     app.config.get("CACHE_REDIS_TTL_SECONDS", 24 * 3600)))
+    DBM._cache = cache.TieredCache(tiers + [_SQLiteTier()], backing_only=("video_meta",))
+    DBM._comment_cache_max_entries = app.config.get("COMMENT_CACHE_MAX_ENTRIES", COMMENT_CACHE_MAX_ENTRIES)
     # IMPORTANT: create the database on disk
-    _db.create_all()
+    try:
+        _db.create_all()
+    except exc.OperationalError as e:
+        # another process created the tables between the check and the create
+        if "already exists" not in str(e):
+            raise
+    _migrate(app)
     # return the bound app
     return app
+
+
+def _migrate(app):
+    """Helper function to add the columns added since the database was
+    created. Reports stored before get the default expiry."""
+    engine = _db.get_engine(app)
+    columns = {column["name"] for column in inspect(engine).get_columns(_ReportEntry.__tablename__)}
+    statements = []
+    if "comment_count" not in columns:
+        statements.append("ALTER TABLE report_entry ADD COLUMN comment_count INTEGER")
+    if "expires_at" not in columns:
+        statements.append("ALTER TABLE report_entry ADD COLUMN expires_at DATETIME")
+        statements.append(f"UPDATE report_entry SET expires_at = "
+                          f"datetime(latest_update, '+{REPORT_TTL.days} days') WHERE expires_at IS NULL")
+    if "refresh_failures" not in columns:
+        statements.append("ALTER TABLE report_entry ADD COLUMN refresh_failures INTEGER")
+    if "refresh_after" not in columns:
+        statements.append("ALTER TABLE report_entry ADD COLUMN refresh_after DATETIME")
+    statements.append("CREATE INDEX IF NOT EXISTS ix_report_entry_expires_at ON report_entry (expires_at)")
+    for statement in statements:
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(statement))
+        except exc.OperationalError as e:
+            # another process migrated the database meanwhile
+            if "duplicate column" not in str(e):
+                raise
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Helper function to configure every new SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+
+def shutdown():
+    """Function to write the queued entries before the process exits."""
+    if DBM._writer:
+        DBM._writer.stop()
+
+
+def stats() -> dict:
+    """Function returns the counters of the storage."""
+    if not DBM._writer:
+        return {"mode": SYNC, "tiers": DBM._cache.stats()}
+    return dict(mode=WRITE_BEHIND, tiers=DBM._cache.stats(), **DBM._writer.stats())
+
+
+def dispose_engine(app):
+    """Function to drop the pooled connections of the database, e.g. after
+    forking, so that every process opens its own connections."""
+    with app.app_context():
+        _db.get_engine(app).dispose()
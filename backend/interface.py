@@ -10,21 +10,47 @@ any changes, should conform to the open source licence as provided.
 
 """
 
-from typing import Optional, Tuple
+import copy
+from typing import Callable, Optional, Tuple
 from . import datatypes
 from . import utils
 
 
-def main(video_id: str) -> Tuple[Optional[datatypes.Video], Optional[datatypes.Report]]:
+def main(video_id: str, progress: Optional[Callable[[str], None]] = None, meta: Optional[list] = None,
+         budget: int = utils.MAX_NUMBER_COMMENTS, timeout: float = utils.COMMENT_DEADLINE_SECONDS,
+         previous_video: Optional[datatypes.Video] = None,
+         previous_report: Optional[datatypes.Report] = None,
+         deadline: Optional[datatypes.Deadline] = None) \
+        -> Tuple[Optional[datatypes.Video], Optional[datatypes.Report]]:
     """Main interface for backend, called by flask. It returns the
     result of sentiment analysis and the filename of the word cloud
-    picture.
+    picture. progress, if given, is called with the name of each stage
+    as the pipeline enters it; meta, if given, is the already fetched
+    meta data of the video; at most budget comments are fetched within
+    timeout seconds. previous_video and previous_report, if given, are the
+    stored result of the last analysis, which is refreshed incrementally.
+    deadline, if given, bounds the whole pipeline: the report returned when
+    it is near is marked partial.
     """
-    video = utils.video_data_aggregate(video_id)
+    if previous_report and previous_report.partial:
+        # the snapshot of a partial report is incomplete, fetch it all again
+        previous_video = previous_report = None
+    if progress:
+        progress("fetching")
+    if not (previous_video and previous_report and previous_video.comment_ids):
+        # the comments are analyzed as they are fetched
+        return utils.video_report_stream(video_id, meta, budget, timeout, deadline, progress)
+    video = utils.video_data_aggregate(video_id, meta, budget, timeout, previous_video, deadline)
     if not video:
         return None, None
+    elif video.comment_ids == previous_video.comment_ids:
+        # no new comments, only the meta data may have changed
+        report = copy.copy(previous_report)
+        report.video_title, report.tags = video.video_title, video.tags
     else:
-        report = utils.get_report(video)
+        if progress:
+            progress("analyzing")
+        report = utils.get_report(video, deadline, budget)
     return video, report
 
 
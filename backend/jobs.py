@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Emotional-YouTube Background Report Jobs
+Jan(Zhan) Lu and Haoyan Wang, Winter 2020
+
+This code is provided for non-commercial and study purpose.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, should conform to the open source licence as provided.
+
+"""
+
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Job status
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """Exception class raised when too many jobs are waiting for a worker."""
+
+    def __str__(self) -> str:
+        return "Too many report jobs are pending"
+
+
+class Job:
+    """Class represents one background report generation.
+
+    === Attributes ===
+    job_id  : unique id of the job;
+    video_id: the video being analyzed;
+    status  : one of pending, running, done and failed;
+    stage   : the latest stage reported by the pipeline;
+    result  : the report on success;
+    error   : string representation of the error on failure;
+    created : time (epoch seconds) at which the job was submitted;
+    finished: time (epoch seconds) at which the job finished, or None.
+    """
+
+    job_id: str
+    video_id: str
+    status: str
+    stage: str
+    result: Any
+    error: Optional[str]
+    created: float
+    finished: Optional[float]
+
+    def __init__(self, video_id: str):
+        self.job_id = uuid.uuid4().hex
+        self.video_id = video_id
+        self.status = PENDING
+        self.stage = PENDING
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._events: List[Tuple[str, dict]] = [("stage", {"stage": PENDING})]
+        self._cond = threading.Condition()
+
+    def progress(self, stage: str) -> None:
+        """Record that the pipeline entered the given stage."""
+        with self._cond:
+            self.stage = stage
+            self._events.append(("stage", {"stage": stage}))
+            self._cond.notify_all()
+
+    def _start(self) -> None:
+        with self._cond:
+            self.status = RUNNING
+        self.progress(RUNNING)
+
+    def _finish(self, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        with self._cond:
+            self.status = status
+            self.stage = status
+            self.result = result
+            self.error = error
+            self.finished = time.time()
+            self._events.append((status, {"stage": status}))
+            self._cond.notify_all()
+
+    def is_finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def wait_events(self, seen: int, timeout: float) -> Tuple[List[Tuple[str, dict]], bool]:
+        """Block until there are events after the first seen ones, or until
+        timeout. Returns the new events and whether the job has finished.
+        """
+        with self._cond:
+            if len(self._events) <= seen and not self.is_finished():
+                self._cond.wait(timeout)
+            return self._events[seen:], self.is_finished()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "video_id": self.video_id,
+            "status": self.status,
+            "stage": self.stage,
+            "error": self.error
+        }
+
+
+class JobManager:
+    """Runs report jobs on a bounded pool of worker threads. At most one job
+    per video is active at any time; submitting a video that already has an
+    active job returns that job.
+
+    === Attributes ===
+    max_workers: number of worker threads;
+    max_pending: maximum number of active jobs before submissions are refused;
+    retention  : seconds for which finished jobs are kept for polling.
+    """
+
+    max_workers: int
+    max_pending: int
+    retention: float
+
+    def __init__(self, runner: Callable[..., Any], max_workers: int = 4,
+                 max_pending: int = 256, retention: float = 600):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retention = retention
+        self._runner = runner
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="report-job")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Job] = {}
+        self._active: Dict[str, Job] = {}
+        self._submitted = 0
+        self._deduplicated = 0
+        self._failed = 0
+
+    def submit(self, video_id: str, *args) -> Job:
+        """Schedule runner(job, *args) for the video and return the job."""
+        with self._lock:
+            self._prune()
+            job = self._active.get(video_id)
+            if job:
+                self._deduplicated += 1
+                return job
+            if len(self._active) >= self.max_pending:
+                raise JobQueueFull()
+            job = Job(video_id)
+            self._jobs[job.job_id] = job
+            self._active[video_id] = job
+            self._submitted += 1
+        self._executor.submit(self._run, job, *args)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def is_active(self, video_id: str) -> bool:
+        """Return whether a job of the video is pending or running."""
+        with self._lock:
+            return video_id in self._active
+
+    def _run(self, job: Job, *args) -> None:
+        job._start()
+        try:
+            result = self._runner(job, *args)
+        except Exception as e:
+            # TODO: logging
+            print(e)
+            with self._lock:
+                self._failed += 1
+            job._finish(FAILED, error=str(e))
+        else:
+            job._finish(DONE, result=result)
+        finally:
+            with self._lock:
+                if self._active.get(job.video_id) is job:
+                    del self._active[job.video_id]
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting jobs; if wait, block until running jobs are done."""
+        self._executor.shutdown(wait=wait)
+
+    def _prune(self) -> None:
+        """Drop finished jobs older than the retention period. Caller must
+        hold the lock."""
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "active": len(self._active),
+                "tracked": len(self._jobs),
+                "submitted": self._submitted,
+                "deduplicated": self._deduplicated,
+                "failed": self._failed
+            }
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Emotional-YouTube Quota of the Upstream APIs
+Jan(Zhan) Lu and Haoyan Wang, Winter 2020
+
+This code is provided for non-commercial and study purpose.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, should conform to the open source licence as provided.
+
+"""
+
+import os
+import json
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, where the server runs in a single process
+    fcntl = None
+
+# priority classes, highest first
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BACKGROUND, BULK)
+
+# units one call of each method costs, and the api whose quota it uses; the
+# cost of annotateText is per record of 1000 characters, for two features
+COSTS = {
+    "youtube.videos.list": ("youtube", 1),
+    "youtube.commentThreads.list": ("youtube", 1),
+    "language.annotateText": ("language", 2)
+}
+# capacity of the bucket of each api and the units it gets back per second:
+# the daily quota of the YouTube Data API, the per-minute one of NLP
+DEFAULT_LIMITS = {
+    "youtube": (10000, 10000 / 86400),
+    "language": (600, 600 / 60)
+}
+# share of the capacity a class leaves to the classes above it, so that the
+# lower classes are delayed and shed first
+DEFAULT_RESERVES = {INTERACTIVE: 0.0, BACKGROUND: 0.2, BULK: 0.4}
+# seconds a call of each class may wait for units before it is shed
+DEFAULT_MAX_WAITS = {INTERACTIVE: 1.0, BACKGROUND: 10.0, BULK: 30.0}
+# longest retry time told to a shed call
+MAX_RETRY_AFTER = 86400
+
+# priority class of the calls of the current request or job
+_priority: ContextVar[str] = ContextVar("quota_priority", default=INTERACTIVE)
+
+
+class QuotaExceeded(Exception):
+    """Exception class for a call shed for lack of quota
+
+    === Attributes ===
+    api        : name of the api;
+    priority   : priority class of the call;
+    retry_after: seconds until the call would have enough units.
+    """
+
+    api: str
+    priority: str
+    retry_after: float
+
+    def __init__(self, api: str, priority: str, retry_after: float):
+        self.api = api
+        self.priority = priority
+        self.retry_after = retry_after
+
+    def __str__(self) -> str:
+        return f"Quota of {self.api} exceeded for {self.priority} calls, retry after {self.retry_after:.0f}s"
+
+
+@contextmanager
+def priority(level: str):
+    """Context manager running the calls of its block in the priority class."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+class TokenBucket:
+    """Bucket of the quota units of one api. A call of a priority class takes
+    its units only while the bucket keeps the reserve of the class; otherwise
+    it waits for the refill up to the maximum wait of the class, or is shed
+    at once if the wait would be longer. Given a state file, the units left
+    are kept in it under the lock of its lock file, so that every process of
+    the host draws from the same bucket, and a restarted process finds the
+    bucket as it was left; otherwise the bucket is the process's own.
+
+    === Attributes ===
+    name      : name of the bucket in the state file;
+    capacity  : maximum units in the bucket;
+    refill    : units added per second;
+    reserves  : share of the capacity each class leaves untouched;
+    max_waits : seconds a call of each class may wait;
+    state_path: path of the state file shared by the processes, or None.
+    """
+
+    name: str
+    capacity: float
+    refill: float
+    reserves: Dict[str, float]
+    max_waits: Dict[str, float]
+    state_path: Optional[str]
+
+    def __init__(self, capacity: float, refill: float, reserves: Dict[str, float] = None,
+                 max_waits: Dict[str, float] = None, name: str = "", state_path: Optional[str] = None):
+        self.name = name
+        self.capacity = capacity
+        self.refill = refill
+        self.reserves = dict(reserves or DEFAULT_RESERVES)
+        self.max_waits = dict(max_waits or DEFAULT_MAX_WAITS)
+        self.state_path = state_path if fcntl else None
+        self._tokens = float(capacity)
+        # wall-clock time, which the processes share
+        self._updated = time.time()
+        self._lock = threading.Lock()
+        self._counts = {level: {"granted": 0, "units": 0, "delayed": 0, "shed": 0} for level in PRIORITIES}
+
+    @contextmanager
+    def _held(self):
+        """Context manager holding the bucket: its lock, and the lock file of
+        the state file, whose state is loaded before the block and saved
+        after it unless the block raises. The state is written to a
+        temporary file that replaces the state file, so that a process
+        killed while saving leaves the previous state rather than a file cut
+        short."""
+        with self._lock:
+            if not self.state_path:
+                yield
+                return
+            with open(self.state_path + ".lock", "a") as lock_file:
+                # released when the file is closed
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    with open(self.state_path) as file:
+                        states = json.loads(file.read() or "{}")
+                except FileNotFoundError:
+                    states = {}
+                except ValueError:
+                    # written by a version that saved in place, start with a full bucket
+                    states = {}
+                if self.name in states:
+                    self._tokens, self._updated = states[self.name]
+                yield
+                states[self.name] = [self._tokens, self._updated]
+                self._save(states)
+
+    def _save(self, states: dict) -> None:
+        """Write states to a temporary file next to the state file, and
+        replace the state file with it."""
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        fd, temp_path = tempfile.mkstemp(prefix=".quota-", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as file:
+                file.write(json.dumps(states))
+                file.flush()
+                os.fsync(file.fileno())
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.state_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _refill(self) -> None:
+        now = time.time()
+        # the clock may be set back
+        self._tokens = min(self.capacity, self._tokens + max(0.0, now - self._updated) * self.refill)
+        self._updated = now
+
+    def acquire(self, units: float, level: str, name: str = "") -> None:
+        """Take units for a call of the priority class, waiting if needed;
+        raises QuotaExceeded if the call is shed."""
+        deadline = time.monotonic() + self.max_waits[level]
+        delayed = False
+        while True:
+            with self._held():
+                self._refill()
+                floor = self.capacity * self.reserves[level]
+                missing = units + floor - self._tokens
+                if missing <= 0:
+                    self._tokens -= units
+                    counts = self._counts[level]
+                    counts["granted"] += 1
+                    counts["units"] += units
+                    counts["delayed"] += delayed
+                    return
+                wait = missing / self.refill if self.refill > 0 else float("inf")
+                if time.monotonic() + wait > deadline:
+                    self._counts[level]["shed"] += 1
+                    raise QuotaExceeded(name, level, min(wait, MAX_RETRY_AFTER))
+            delayed = True
+            time.sleep(wait)
+
+    def stats(self) -> dict:
+        with self._held():
+            self._refill()
+            return {
+                "remaining": round(self._tokens, 2),
+                "capacity": self.capacity,
+                "refill_per_second": self.refill,
+                "shared": self.state_path is not None,
+                "classes": {level: dict(counts) for level, counts in self._counts.items()}
+            }
+
+
+class QuotaScheduler:
+    """Scheduler every upstream call goes through. It looks up the cost of
+    the method, and takes the units from the bucket of its api in the
+    priority class of the current context. The buckets are kept in the
+    state file at state_path if given, see TokenBucket.
+    """
+
+    def __init__(self, limits: Dict[str, tuple] = None, reserves: Dict[str, float] = None,
+                 max_waits: Dict[str, float] = None, state_path: Optional[str] = None):
+        self._buckets = {api: TokenBucket(capacity, refill, reserves, max_waits, api, state_path)
+                         for api, (capacity, refill) in (limits or DEFAULT_LIMITS).items()}
+
+    def acquire(self, method: str, count: int = 1) -> None:
+        """Take the units of count calls, or records, of the method; raises
+        QuotaExceeded if the call is shed."""
+        api, cost = COSTS[method]
+        self._buckets[api].acquire(cost * count, current_priority(), api)
+
+    def stats(self) -> dict:
+        return {api: bucket.stats() for api, bucket in self._buckets.items()}
+
+
+# scheduler of the process, see configure()
+_scheduler: Optional[QuotaScheduler] = None
+
+
+def configure(limits: Dict[str, tuple] = None, reserves: Dict[str, float] = None,
+              max_waits: Dict[str, float] = None, state_path: Optional[str] = None) -> QuotaScheduler:
+    """Function to set up the quota scheduler of the process."""
+    global _scheduler
+    _scheduler = QuotaScheduler(limits, reserves, max_waits, state_path)
+    return _scheduler
+
+
+def default_scheduler() -> QuotaScheduler:
+    """Function returns the quota scheduler of the process."""
+    return _scheduler or configure()
+
+
+def acquire(method: str, count: int = 1) -> None:
+    """Function to take the units of a call from the scheduler of the process."""
+    default_scheduler().acquire(method, count)
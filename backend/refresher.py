@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Emotional-YouTube Background Refresh of Expiring Reports
+Jan(Zhan) Lu and Haoyan Wang, Winter 2020
+
+This code is provided for non-commercial and study purpose.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, should conform to the open source licence as provided.
+
+"""
+
+import time
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, where the server runs in a single process
+    fcntl = None
+
+# window over which the quota budget is counted
+BUDGET_WINDOW = 24 * 3600
+
+
+class Refresher:
+    """Background thread that refreshes the reports expiring soonest before
+    clients ask for them, within a budget of API quota units per day. Only
+    the refreshes scheduled count against the budget; refresh returns False
+    for a video whose refresh is already running. select_due leaves out the
+    videos whose refresh failed lately. When several processes run a
+    refresher on the same lock file, only the one holding the lock
+    refreshes.
+
+    === Attributes ===
+    interval         : seconds between two rounds;
+    lookahead        : reports expiring within this time are due;
+    batch_size       : maximum number of refreshes per round;
+    units_per_refresh: estimated quota units one refresh costs;
+    budget_units     : quota units the refresher may spend per day.
+    """
+
+    interval: float
+    lookahead: timedelta
+    batch_size: int
+    units_per_refresh: int
+    budget_units: int
+
+    def __init__(self, select_due: Callable[[int, datetime], List[str]], refresh: Callable[[str], bool],
+                 units_per_refresh: int, budget_units: int, interval: float = 60,
+                 lookahead: timedelta = timedelta(hours=1), batch_size: int = 20,
+                 lock_path: Optional[str] = None):
+        self.interval = interval
+        self.lookahead = lookahead
+        self.batch_size = batch_size
+        self.units_per_refresh = units_per_refresh
+        self.budget_units = budget_units
+        self._select_due = select_due
+        self._refresh = refresh
+        self._lock_path = lock_path
+        self._lock_file = None
+        self._spent = deque()
+        self._stop = threading.Event()
+        self._thread = None
+        self._rounds = 0
+        self._refreshed = 0
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                # TODO: logging
+                print(e)
+
+    def run_once(self) -> int:
+        """Schedule the refresh of the reports due; returns how many."""
+        if not self._owns_lock():
+            return 0
+        self._rounds += 1
+        available = self.budget_units - self._spent_units()
+        limit = min(self.batch_size, available // self.units_per_refresh)
+        if limit <= 0:
+            return 0
+        count = 0
+        for vid in self._select_due(limit, datetime.utcnow() + self.lookahead):
+            try:
+                scheduled = self._refresh(vid)
+            except Exception as e:
+                # e.g. the job queue is full, try again next round
+                print(e)
+                break
+            if scheduled:
+                self._spent.append((time.time(), self.units_per_refresh))
+                count += 1
+        self._refreshed += count
+        return count
+
+    def _spent_units(self) -> int:
+        cutoff = time.time() - BUDGET_WINDOW
+        while self._spent and self._spent[0][0] < cutoff:
+            self._spent.popleft()
+        return sum(units for _, units in self._spent)
+
+    def _owns_lock(self) -> bool:
+        if not self._lock_path or not fcntl:
+            return True
+        if self._lock_file:
+            return True
+        lock_file = open(self._lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # held until the process exits
+        self._lock_file = lock_file
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "owner": self._lock_file is not None or not self._lock_path or not fcntl,
+            "rounds": self._rounds,
+            "refreshed": self._refreshed,
+            "budget_units": self.budget_units,
+            "spent_units": self._spent_units()
+        }
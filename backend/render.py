@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Emotional-YouTube Word-cloud Renderer
+Jan(Zhan) Lu and Haoyan Wang, Winter 2020
+
+This code is provided for non-commercial and study purpose.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, should conform to the open source licence as provided.
+
+"""
+
+import os
+import threading
+import multiprocessing
+from io import BytesIO
+from random import Random
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, FrozenSet, Optional
+from wordcloud import WordCloud
+
+_DAT = os.path.join(os.path.abspath(os.path.dirname(__file__)), "..", "dat")
+EN_FONT = "CODE Light.otf"
+CH_FONT = "STKAITI.TTF"
+# font and stopwords of each language; the others use the English font and
+# no stopwords
+FONTS = {"en": EN_FONT, "zh-cn": CH_FONT}
+STOPWORDS = {"en": "en_stopwords.txt"}
+# most words laid out in a word cloud
+MAX_WORDS = 2000
+# seed of the layout, so that the same frequencies give the same image
+LAYOUT_SEED = 10
+# languages whose word cloud each worker prepares when it starts
+PRELOAD_LANGS = ("en", "zh-cn")
+RENDER_WORKERS = min(4, os.cpu_count() or 1)
+# seconds a render may take, including its wait for a free worker
+RENDER_TIMEOUT_SECONDS = 10
+# workers are started from a clean process, not forked from the threads of
+# the app
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# word clouds of the worker process, by language, see _init_worker()
+_wordclouds: Dict[str, WordCloud] = {}
+
+
+@lru_cache(maxsize=None)
+def stopwords(lang: str) -> FrozenSet[str]:
+    """Function returns the stopwords of the language, loaded once."""
+    if lang not in STOPWORDS:
+        return frozenset()
+    with open(os.path.join(_DAT, STOPWORDS[lang]), encoding="utf-8") as file:
+        return frozenset(word.rstrip() for word in file)
+
+
+def _new_wordcloud(lang: str) -> WordCloud:
+    """Function to create the word cloud of the language, with its font."""
+    return WordCloud(
+        background_color=None,
+        mode="RGBA",
+        font_path=os.path.join(_DAT, FONTS.get(lang, EN_FONT)),
+        max_words=MAX_WORDS,
+        width=1000,
+        height=800,
+        max_font_size=150,
+        random_state=LAYOUT_SEED
+    )
+
+
+def _init_worker() -> None:
+    """Initializer of a worker process: prepares the word cloud of each
+    language of PRELOAD_LANGS whose font is installed, and lays out one word
+    so that the font and the layout code are loaded before the first
+    render."""
+    for lang in PRELOAD_LANGS:
+        if os.path.isfile(os.path.join(_DAT, FONTS[lang])):
+            wordcloud = _new_wordcloud(lang)
+            wordcloud.generate_from_frequencies({"warm": 1.0}).to_image()
+            _wordclouds[lang] = wordcloud
+
+
+def _render(frequencies: Dict[str, int], lang: str) -> bytes:
+    """Function run in a worker process: lays out the words, each sized by
+    its frequency, and returns the png image."""
+    if lang not in _wordclouds:
+        _wordclouds[lang] = _new_wordcloud(lang)
+    wordcloud = _wordclouds[lang]
+    # the word cloud is reused, its random state would go on from the last render
+    wordcloud.random_state = Random(LAYOUT_SEED)
+    wordcloud.generate_from_frequencies(frequencies)
+    png = BytesIO()
+    wordcloud.to_image().save(png, format="png", optimize=True)
+    return png.getvalue()
+
+
+def _ready() -> bool:
+    return True
+
+
+class Renderer:
+    """Pool of worker processes rendering word clouds, so that the layout
+    runs outside of the request threads and on every core. At most
+    max_pending renders are submitted at once; a render waits for a free
+    slot and for its result for at most timeout seconds. The pool is
+    started on first use in each process, so a forked process starts its
+    own.
+
+    === Attributes ===
+    workers    : number of worker processes;
+    max_pending: maximum number of renders submitted at once;
+    timeout    : seconds a render may take.
+    """
+
+    workers: int
+    max_pending: int
+    timeout: float
+
+    def __init__(self, workers: int = RENDER_WORKERS, max_pending: Optional[int] = None,
+                 timeout: float = RENDER_TIMEOUT_SECONDS):
+        self.workers = workers
+        self.max_pending = max_pending or 2 * workers
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._rendered = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._failed = 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        """Return the pool of this process, started on the first call."""
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                if self._pid != os.getpid():
+                    # the slots of the parent are not ours
+                    self._slots = threading.BoundedSemaphore(self.max_pending)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context(START_METHOD),
+                                                     initializer=_init_worker)
+                self._pid = os.getpid()
+            return self._executor
+
+    def render(self, frequencies: Dict[str, int], lang: str, timeout: Optional[float] = None) -> Optional[bytes]:
+        """Render the word cloud of the word frequencies as a png image,
+        within timeout seconds if given and shorter than the timeout of the
+        renderer. Returns None if the render is rejected, times out or
+        fails."""
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        pool = self._pool()
+        slots = self._slots
+        if not slots.acquire(timeout=timeout):
+            self._rejected += 1
+            print(f"Word cloud not rendered, {self.max_pending} renders pending")
+            return None
+        try:
+            future = pool.submit(_render, frequencies, lang)
+        except (BrokenProcessPool, RuntimeError) as e:
+            slots.release()
+            self._restart(e)
+            return None
+        # the slot is held until the worker is done, even after a timeout
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            png = future.result(timeout=timeout)
+        except TimeoutError:
+            self._timeouts += 1
+            print(f"Word cloud not rendered within {timeout:.1f}s")
+            return None
+        except BrokenProcessPool as e:
+            self._restart(e)
+            return None
+        except Exception as e:
+            # TODO: logging
+            print(e)
+            self._failed += 1
+            return None
+        self._rendered += 1
+        return png
+
+    def _restart(self, error: Exception) -> None:
+        """Drop a pool whose worker died; the next render starts a new one."""
+        # TODO: logging
+        print(f"Renderer pool failed: {error}")
+        self._failed += 1
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False)
+
+    def scale(self, fraction: float) -> None:
+        """Keep only the fraction of the workers, e.g. the share of a process;
+        to be called before the pool of the process is started."""
+        with self._lock:
+            self.workers = max(1, int(self.workers * fraction))
+            self.max_pending = max(self.workers, int(self.max_pending * fraction))
+            self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def warm_up(self) -> None:
+        """Start the worker processes, which prepare their word clouds."""
+        self._pool().submit(_ready).result()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor and self._pid == os.getpid():
+            executor.shutdown()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "started": self._executor is not None and self._pid == os.getpid(),
+            "rendered": self._rendered,
+            "rejected": self._rejected,
+            "timeouts": self._timeouts,
+            "failed": self._failed
+        }
+
+
+# renderer of the word clouds of the reports, see configure()
+_renderer: Optional[Renderer] = None
+
+
+def configure(workers: int = RENDER_WORKERS, max_pending: Optional[int] = None,
+              timeout: float = RENDER_TIMEOUT_SECONDS) -> Renderer:
+    """Function to set up the renderer of the word clouds."""
+    global _renderer
+    _renderer = Renderer(workers, max_pending, timeout)
+    return _renderer
+
+
+def default_renderer() -> Renderer:
+    """Function returns the renderer of the word clouds."""
+    return _renderer or configure()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Emotional-YouTube Cache of Serialized Report Responses
+Jan(Zhan) Lu and Haoyan Wang, Winter 2020
+
+This code is provided for non-commercial and study purpose.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, should conform to the open source licence as provided.
+
+"""
+
+import gzip
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from typing import Optional, Union
+
+try:
+    # optional: brotli variants are only kept when the package is installed
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# bytes a marker of an invalidated entry is counted for
+MARKER_BYTES = 64
+
+
+class CachedResponse:
+    """Class stores the serialized response of one report version.
+
+    === Attributes ===
+    video_id     : id of the video;
+    latest_update: time of the report update the response was built from;
+    expires_at   : time at which the report expires;
+    identity     : the response body;
+    gzip         : the gzip encoded body;
+    br           : the brotli encoded body, or None without brotli;
+    size         : number of bytes held by the three variants.
+    """
+
+    video_id: str
+    latest_update: datetime
+    expires_at: datetime
+    identity: bytes
+    gzip: bytes
+    br: Optional[bytes]
+    size: int
+
+    def __init__(self, video_id: str, latest_update: datetime, expires_at: datetime, body: bytes):
+        self.video_id = video_id
+        self.latest_update = latest_update
+        self.expires_at = expires_at
+        self.identity = body
+        self.gzip = gzip.compress(body, GZIP_LEVEL)
+        self.br = brotli.compress(body, quality=BROTLI_QUALITY) if brotli else None
+        self.size = len(self.identity) + len(self.gzip) + len(self.br or b"")
+
+    def encoded(self, accept_encodings) -> tuple:
+        """Return the best body for the Accept-Encoding of the request and
+        its Content-Encoding (None for identity)."""
+        if self.br is not None and accept_encodings["br"]:
+            return self.br, "br"
+        if accept_encodings["gzip"]:
+            return self.gzip, "gzip"
+        return self.identity, None
+
+
+class _Invalidated:
+    """Marker left in the cache by the write of a report version, so that
+    the responses of older versions are not cached after it.
+
+    === Attributes ===
+    latest_update: time of the report update written;
+    size         : number of bytes the marker is counted for.
+    """
+
+    latest_update: datetime
+    size: int
+
+    def __init__(self, latest_update: datetime):
+        self.latest_update = latest_update
+        self.size = MARKER_BYTES
+
+
+class ResponseCache:
+    """Size-bounded LRU of serialized report responses. Entries are keyed on
+    (video_id, latest_update): at most one version per video is kept, and a
+    newer version replaces the older one. A write invalidates the response
+    of the video and leaves the version it wrote, so that a reader that
+    loaded an older version before the write cannot cache it afterwards.
+    The cache is per process; writes of other processes are only seen once
+    the entry expires.
+
+    === Attributes ===
+    max_bytes: upper bound of the bytes held by all entries.
+    """
+
+    max_bytes: int
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Union[CachedResponse, _Invalidated]]" = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, video_id: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if isinstance(entry, _Invalidated):
+                entry = None
+            if entry:
+                self._entries.move_to_end(video_id)
+                self._hits += 1
+            else:
+                self._misses += 1
+            return entry
+
+    def put(self, video_id: str, latest_update: datetime, expires_at: datetime,
+            body: bytes) -> CachedResponse:
+        """Serialize the variants of body, cache them and return the entry.
+        The entry is not cached if a newer version was cached or written
+        meanwhile."""
+        entry = CachedResponse(video_id, latest_update, expires_at, body)
+        if entry.size > self.max_bytes:
+            return entry
+        with self._lock:
+            old = self._entries.get(video_id)
+            if old and old.latest_update > latest_update:
+                # a newer version was cached or written meanwhile
+                return entry
+            self._add(video_id, entry)
+        return entry
+
+    def invalidate(self, video_id: str, latest_update: datetime) -> None:
+        """Drop the response of the video, whose report version latest_update
+        was just written."""
+        with self._lock:
+            old = self._entries.get(video_id)
+            if old and old.latest_update > latest_update:
+                latest_update = old.latest_update
+            self._add(video_id, _Invalidated(latest_update))
+
+    def discard(self, video_id: str, latest_update: datetime) -> None:
+        """Drop the response or the marker of the report version
+        latest_update of the video, which was not stored after all, so that
+        the stored version can be cached again."""
+        with self._lock:
+            old = self._entries.get(video_id)
+            if old and old.latest_update == latest_update:
+                self._remove(video_id)
+
+    def _add(self, video_id: str, entry: Union[CachedResponse, _Invalidated]) -> None:
+        """Replace the entry of the video, and evict the least recently used
+        entries beyond max_bytes. Caller must hold the lock."""
+        self._remove(video_id)
+        self._entries[video_id] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._evictions += 1
+
+    def _remove(self, video_id: str) -> None:
+        """Drop the entry of the video. Caller must hold the lock."""
+        entry = self._entries.pop(video_id, None)
+        if entry:
+            self._bytes -= entry.size
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": sum(isinstance(entry, CachedResponse) for entry in self._entries.values()),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else 0.0,
+                "evictions": self._evictions,
+                "brotli": brotli is not None
+            }
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Emotional-YouTube Production Server
+Jan(Zhan) Lu and Haoyan Wang, Winter 2020
+
+This code is provided for non-commercial and study purpose.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, should conform to the open source licence as provided.
+
+"""
+
+import multiprocessing
+from flask import Flask
+from . import db
+from . import render
+from . import utils
+from .app import shutdown, start_background
+
+
+def default_workers() -> int:
+    """Function returns the usual number of worker processes for this host."""
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def warm_up() -> None:
+    """Function to load everything that is otherwise loaded lazily on the
+    first request, so that pre-forked workers share it copy-on-write."""
+    utils.warm_up()
+
+
+def serve(app: Flask, host: str, port: int, workers: int, threads: int,
+          timeout: int = 120, graceful_timeout: int = 30) -> None:
+    """Function to run the app with gunicorn: a master process that has the
+    app and its expensive imports loaded, and workers pre-forked from it,
+    each serving requests on the given number of threads.
+
+    Send SIGHUP to the master for a graceful reload of the workers and
+    SIGTERM for a graceful shutdown.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("The production server requires gunicorn: pip install gunicorn")
+        raise SystemExit(1)
+
+    class _Application(BaseApplication):
+        def __init__(self, options: dict):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    def post_fork(server, worker):
+        # connections opened by the master must not be shared by the workers
+        db.dispose_engine(app)
+        # the workers share the cores of the word-cloud renderers
+        render.default_renderer().scale(1 / workers)
+        start_background()
+
+    def worker_exit(server, worker):
+        # let the background jobs of the worker finish their writes
+        shutdown()
+
+    warm_up()
+    _Application({
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "threads": threads,
+        "worker_class": "gthread" if threads > 1 else "sync",
+        "preload_app": True,
+        "timeout": timeout,
+        "graceful_timeout": graceful_timeout,
+        "post_fork": post_fork,
+        "worker_exit": worker_exit
+    }).run()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Emotional-YouTube In-flight Request Coalescing
+Jan(Zhan) Lu and Haoyan Wang, Winter 2020
+
+This code is provided for non-commercial and study purpose.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, should conform to the open source licence as provided.
+
+"""
+
+import threading
+from typing import Any, Callable, Dict
+
+
+class _Call:
+    """Private class represents one in-flight call.
+
+    === Attributes ===
+    done  : event set once the leader has finished;
+    result: value returned by the leader;
+    error : exception raised by the leader, if any;
+    waiters: number of followers waiting on this call.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls sharing the same key. The first caller
+    (the leader) runs the function; every caller arriving while it runs (a
+    follower) blocks and receives the leader's result or exception.
+
+    === Attributes ===
+    leaders  : number of calls that actually ran the function;
+    coalesced: number of calls that were served by another call's result.
+    """
+
+    leaders: int
+    coalesced: int
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) once for all concurrent callers of key."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call:
+                call.waiters += 1
+                self.coalesced += 1
+                is_leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                is_leader = True
+
+        if not is_leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self) -> dict:
+        """Return the counters as a dict."""
+        with self._lock:
+            in_flight = len(self._calls)
+            waiting = sum(call.waiters for call in self._calls.values())
+        total = self.leaders + self.coalesced
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "in_flight": in_flight,
+            "waiting": waiting,
+            "coalesced_ratio": self.coalesced / total if total else 0.0
+        }
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Emotional-YouTube Adaptive Report Expiry
+Jan(Zhan) Lu and Haoyan Wang, Winter 2020
+
+This code is provided for non-commercial and study purpose.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, should conform to the open source licence as provided.
+
+"""
+
+from datetime import datetime, timedelta
+from typing import Optional
+from . import datatypes
+
+# bounds of the time to live of a report
+MIN_TTL = timedelta(hours=6)
+MAX_TTL = timedelta(days=60)
+# used when nothing is known about the video
+DEFAULT_TTL = timedelta(days=10)
+# a report is refreshed once about this many new comments are expected
+NEW_COMMENTS_PER_REFRESH = 50
+# a report lives at most this fraction of the age of its video, so that new
+# videos, whose comment sections move fast, are refreshed often
+MAX_TTL_AGE_RATIO = 0.25
+# a failed background refresh is retried after REFRESH_RETRY_BASE, doubled
+# with each failure in a row up to REFRESH_RETRY_MAX; after
+# MAX_REFRESH_FAILURES failures in a row the video is no longer refreshed in
+# the background, only on request
+REFRESH_RETRY_BASE = timedelta(minutes=15)
+REFRESH_RETRY_MAX = timedelta(days=1)
+MAX_REFRESH_FAILURES = 5
+
+
+def compute_ttl(video: Optional[datatypes.Video], now: datetime,
+                previous_count: Optional[int] = None,
+                previous_update: Optional[datetime] = None) -> timedelta:
+    """Function to compute how long the report of the video stays fresh.
+
+    The churn of the comment section is measured from the comment counts of
+    this and the previous refresh; on the first refresh the lifetime average
+    of the video is used instead. The report expires once about
+    NEW_COMMENTS_PER_REFRESH new comments are expected, and no later than
+    MAX_TTL_AGE_RATIO of the age of the video.
+    """
+    if not video or video.comment_count is None:
+        return DEFAULT_TTL
+
+    age = now - video.published_at if video.published_at else None
+    churn = None
+    if previous_count is not None and previous_update and now > previous_update:
+        elapsed_days = (now - previous_update) / timedelta(days=1)
+        churn = max(video.comment_count - previous_count, 0) / elapsed_days
+    elif age and age > timedelta(0):
+        churn = video.comment_count / (age / timedelta(days=1))
+
+    ttl = MAX_TTL
+    if churn:
+        ttl = min(ttl, timedelta(days=NEW_COMMENTS_PER_REFRESH / churn))
+    if age is not None:
+        ttl = min(ttl, age * MAX_TTL_AGE_RATIO)
+    return min(max(ttl, MIN_TTL), MAX_TTL)
+
+
+def retry_delay(failures: int) -> timedelta:
+    """Function returns how long the background refresh of a video waits
+    after failures failed refreshes in a row."""
+    # the exponent is bounded, so that the delay does not overflow
+    return min(REFRESH_RETRY_BASE * 2 ** min(max(failures - 1, 0), 16), REFRESH_RETRY_MAX)
@@ -14,51 +14,100 @@ any changes, should conform to the open source licence as provided.
 
 import re
 import os
-import langdetect
-from wordcloud import WordCloud
-from typing import Optional, Union, List, Tuple
-from . import datatypes
-from googleapiclient.discovery import build, Resource
+import math
+import time
+import queue
+import random
+import hashlib
+import threading
+import unicodedata
+import contextvars
+from collections import Counter, deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from langdetect.detector_factory import DetectorFactory, PROFILES_DIRECTORY
+from langdetect.lang_detect_exception import LangDetectException
+from typing import Callable, Dict, Iterable, Iterator, Optional, Union, List, Tuple
+from . import analyzers, blobstore, clients, datatypes, db, quota, render
+from googleapiclient.discovery import Resource
 from googleapiclient.errors import HttpError, UnknownApiNameOrVersion
-from google.cloud import language_v1 as language
-# removed in https://github.com/googleapis/python-speech/blob/main/UPGRADING.md#enums-and-types
-# from google.cloud.language import enums, types
-from google.cloud.language_v1 import LanguageServiceClient
+
+# the language of the comments is voted by a sample of them, drawn with a
+# fixed seed; comments shorter than MIN_LANG_CHARACTERS do not vote, and each
+# vote takes LANG_TRIALS trials instead of 7
+LANG_SAMPLE_SIZE = 40
+LANG_SEED = 0
+LANG_TRIALS = 3
+MIN_LANG_CHARACTERS = 10
+# comments are analyzed in the dominant language the analyzer handles if at
+# least this share of them votes for it, since langdetect often misreads
+# short comments; otherwise they are in a language it does not handle
+MIN_ANALYZED_SHARE = 0.25
 
 # YouTube Data API offsets
-YOUTUBE_SERVICE_NAME = "youtube"
-YOUTUBE_API_VERSION = "v3"
+# default comment budget of an analysis, and the time allowed to fetch it
 MAX_NUMBER_COMMENTS = 100
-NUM_RESULTS_PER_REQUEST = 5
+COMMENT_DEADLINE_SECONDS = 10
+# seconds of the deadline of a report kept for the analysis when fetching the
+# comments, and needed left to render the word cloud
+ANALYSIS_RESERVE_SECONDS = 3
+WCLOUD_RESERVE_SECONDS = 1
+# seconds the comments are fetched for, however near the deadline
+MIN_PAGING_SECONDS = 1
+# commentThreads.list returns at most 100 threads per page
+MAX_RESULTS_PER_PAGE = 100
+# orderings fetched concurrently, each page chain is sequential
+COMMENT_ORDERS = ("relevance", "time")
+# pages fetched ahead of the analysis, and seconds between checks of a
+# fetching thread whether the analysis stopped
+PAGE_QUEUE_SIZE = 4
+QUEUE_POLL_SECONDS = 0.1
+# pages of a report being analyzed at once
+ANALYSIS_MAX_IN_FLIGHT = 2
+# threads fetching pages, and threads analyzing them, per priority class
+PAGING_WORKERS = 16
+ANALYSIS_WORKERS = 8
+# only the fields used are transferred
+COMMENT_FIELDS = "nextPageToken,items(id,snippet/topLevelComment/snippet/textDisplay)"
+# reasons of commentThreads.list errors that a retry does not fix: the
+# comments are disabled, or the video is gone
+PERMANENT_COMMENT_ERRORS = ("commentsDisabled", "videoNotFound")
+# videos.list accepts at most 50 ids per call
+MAX_IDS_PER_VIDEOS_LIST = 50
 # Tutorial: https://cloud.google.com/docs/authentication/api-keys
 DEVELOPER_KEY = os.environ["GCP_APIKEY_EmotionalYouTube"]
 # Tutorial: https://cloud.google.com/docs/authentication/application-default-credentials
 GOOGLE_APPLICATION_CREDENTIALS = os.environ["GOOGLE_APPLICATION_CREDENTIALS"]
+# root url of the YouTube Data API, e.g. of a local stand-in server
+YOUTUBE_API_ENDPOINT = os.environ.get("YOUTUBE_API_ENDPOINT")
 
 # Sentiment analysis mark scale and magnitude scale
 SCORE_SCALE = [-0.5, -0.3, -0.1, 0.1, 0.3, 0.5]
 
-# Word-cloud generation constants
-EN_FONT = "CODE Light.otf"
-CH_FONT = "STKAITI.TTF"
-PATH_TO_IMG = r"..\dat\img\{}.png"
-PATH_TO_STOPWORDS = r"..\dat\{}_stopwords.txt"
-PATH_TO_FONTS = r"..\dat\{}"
+
+# the YouTube client of the process, built once
+_youtube = clients.ClientManager(DEVELOPER_KEY, endpoint=YOUTUBE_API_ENDPOINT)
 
 
 def _init_service() -> Optional[Resource]:
-    """Function to construct a API resource.
+    """Function to get the API resource of the process.
     """
     try:
-        return build(serviceName=YOUTUBE_SERVICE_NAME, version=YOUTUBE_API_VERSION,
-                     developerKey=DEVELOPER_KEY)
+        return _youtube.youtube()
     except HttpError:
         print("Fail to construct a resource for interacting with YouTube Data API.")
-    except UnknownApiNameOrVersion:
+    except (UnknownApiNameOrVersion, FileNotFoundError):
         print("Error at API name or version.")
     return None
 
 
+def _execute(method: str, request):
+    """Function to execute a request of the YouTube Data API once the quota
+    scheduler grants its units; raises quota.QuotaExceeded if it is shed."""
+    quota.acquire(f"youtube.{method}")
+    return _youtube.execute(request)
+
+
 def translate_url_to_id(url: str) -> Optional[str]:
     """Function that translate string id to VideoId object
     """
@@ -83,36 +132,210 @@ def _remove_empty_kwargs(**kwargs) -> dict:
     return good_kwargs
 
 
-def _get_comments(client: Resource, **kwargs) -> List[str]:
-    """Function to obtain comments of the video that has video_id in the order 
-    of relevance. ptoken marks where to find the next page of comments. Function 
-    returns a list of comment text.
+# langdetect factory with the language profiles, see _language_factory()
+_lang_factory: Optional[DetectorFactory] = None
+_lang_lock = threading.Lock()
+# the detectors draw their random n-grams from this seed
+DetectorFactory.seed = LANG_SEED
+
+# threads fetching the page chains of the comment orderings, and threads
+# running the analyses bounded by the deadline of a report; each quota
+# priority class has its own, so that batch requests cannot starve the
+# interactive ones
+_paging_pools = {level: ThreadPoolExecutor(max_workers=PAGING_WORKERS, thread_name_prefix=f"paging-{level}")
+                 for level in quota.PRIORITIES}
+_analysis_pools = {level: ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix=f"analysis-{level}")
+                   for level in quota.PRIORITIES}
+
+
+def _comment_page_kwargs(video_id: str, order: str) -> dict:
+    """Helper function returns the arguments of commentThreads.list for the
+    first full-size page in the given order."""
+    return dict(part="snippet", videoId=video_id, maxResults=MAX_RESULTS_PER_PAGE, order=order,
+                textFormat="plainText", fields=COMMENT_FIELDS)
+
+
+def _is_permanent(error: HttpError) -> bool:
+    """Helper function tells whether the error of a comment fetch is one of
+    PERMANENT_COMMENT_ERRORS, which a retry does not fix."""
+    details = error.error_details if isinstance(error.error_details, list) else []
+    return any(isinstance(detail, dict) and detail.get("reason") in PERMANENT_COMMENT_ERRORS
+               for detail in details)
+
+
+def _parse_comments(response: dict) -> List[Tuple[str, str]]:
+    """Helper function returns the (comment id, text) pairs of a page."""
+    return [(item["id"], item["snippet"]["topLevelComment"]["snippet"]["textDisplay"])
+            for item in response.get("items", [])]
+
+
+def _stream_comments(client: Resource, video_id: str, budget: int = MAX_NUMBER_COMMENTS,
+                     timeout: float = COMMENT_DEADLINE_SECONDS,
+                     deadline: Optional[datatypes.Deadline] = None) -> Iterator[List[Tuple[str, str]]]:
+    """Generator of up to budget comments of the video that has video_id,
+    fetched within timeout seconds. The comments are fetched in full-size
+    pages in every order of COMMENT_ORDERS at once, until the distinct
+    comments reach the budget, and each page is yielded as it arrives,
+    without the comments already seen. At most PAGE_QUEUE_SIZE pages wait
+    for the consumer; the fetching waits while they do. The paging stops
+    early enough to leave ANALYSIS_RESERVE_SECONDS of the deadline, if
+    given. Generator yields lists of (comment id, text) pairs. A permanent
+    error of an ordering, see _is_permanent, ends it like its last page; if
+    no comment was fetched, the generator raises the other HttpErrors, and
+    quota.QuotaExceeded if a call was shed.
+    """
+    limit = max(deadline.until(timeout, ANALYSIS_RESERVE_SECONDS), min(timeout, MIN_PAGING_SECONDS)) \
+        if deadline else timeout
+    stop = time.monotonic() + limit
+    pages = queue.Queue(maxsize=PAGE_QUEUE_SIZE)
+    closed = threading.Event()
+    seen = set()
+    lock = threading.Lock()
+    errors = []
+    failed = []
+    shed = []
+    cut = []
+
+    def enough() -> bool:
+        with lock:
+            return len(seen) >= budget
+
+    def put(item) -> bool:
+        # waits while the consumer is behind, until it is gone
+        while not closed.is_set():
+            try:
+                pages.put(item, timeout=QUEUE_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetch(order: str) -> None:
+        kwargs = _comment_page_kwargs(video_id, order)
+        try:
+            while not enough() and time.monotonic() < stop and not closed.is_set():
+                try:
+                    response = _execute("commentThreads.list", client.commentThreads().list(**kwargs))
+                except HttpError as e:
+                    # TODO: logging
+                    print(e)
+                    if not _is_permanent(e):
+                        # analyze the comments fetched so far, if any
+                        failed.append(e)
+                    return
+                except quota.QuotaExceeded as e:
+                    # analyze the comments fetched so far, if any
+                    shed.append(e)
+                    return
+                if not response:
+                    raise datatypes.DataFetchingError(video_id)
+                    # TODO: catch
+                with lock:
+                    page = [comment for comment in _parse_comments(response) if comment[0] not in seen]
+                    seen.update(comment_id for comment_id, _ in page)
+                if not put(page) or "nextPageToken" not in response:
+                    return
+                kwargs["pageToken"] = response["nextPageToken"]
+            if not enough():
+                cut.append(order)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            put(None)
+
+    # the fetches run in the quota priority class of the caller, on its threads
+    for order in COMMENT_ORDERS:
+        _paging_pools[quota.current_priority()].submit(contextvars.copy_context().run, fetch, order)
+    running = len(COMMENT_ORDERS)
+    count = 0
+    try:
+        while running and count < budget:
+            try:
+                page = pages.get(timeout=max(stop - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if page is None:
+                running -= 1
+            elif page[:budget - count]:
+                page = page[:budget - count]
+                count += len(page)
+                yield page
+    finally:
+        closed.set()
+    if (cut or running) and count < budget and limit < timeout:
+        # the deadline of the report, not the paging timeout, stopped the paging
+        deadline.skip("comments")
+    if errors:
+        # raises the errors of the fetch
+        raise errors[0]
+    if (failed or shed) and not count:
+        raise (failed or shed)[0]
+
+
+def _get_comments(client: Resource, video_id: str, budget: int = MAX_NUMBER_COMMENTS,
+                  timeout: float = COMMENT_DEADLINE_SECONDS,
+                  deadline: Optional[datatypes.Deadline] = None) -> List[Tuple[str, str]]:
+    """Function to obtain up to budget comments of the video that has
+    video_id, within timeout seconds, see _stream_comments. Function returns
+    a list of (comment id, text) pairs, in the order they were fetched.
+    """
+    return [comment for page in _stream_comments(client, video_id, budget, timeout, deadline)
+            for comment in page]
+
+
+def _get_new_comments(client: Resource, video_id: str, known_ids: set, budget: int = MAX_NUMBER_COMMENTS,
+                      timeout: float = COMMENT_DEADLINE_SECONDS,
+                      deadline: Optional[datatypes.Deadline] = None) -> List[Tuple[str, str]]:
+    """Function to obtain the comments posted since a snapshot of the video,
+    whose comment ids are known_ids. The comments are fetched newest first
+    until the first known one, so a refresh usually costs a page or two.
+    Function returns at most budget (comment id, text) pairs, newest first.
+    Raises the HttpError of a failed fetch, so that the snapshot is not
+    taken for up to date, unless the error is permanent, see _is_permanent:
+    then the comments fetched so far are returned, and the snapshot is kept
+    until the next refresh.
     """
+    limit = max(deadline.until(timeout, ANALYSIS_RESERVE_SECONDS), min(timeout, MIN_PAGING_SECONDS)) \
+        if deadline else timeout
+    stop = time.monotonic() + limit
+    kwargs = _comment_page_kwargs(video_id, "time")
     comments = []
-    for _ in range(0, MAX_NUMBER_COMMENTS, NUM_RESULTS_PER_REQUEST):
+    while len(comments) < budget and time.monotonic() < stop:
         try:
-            response = client.commentThreads().list(
-                **kwargs
-            ).execute()
+            response = _execute("commentThreads.list", client.commentThreads().list(**kwargs))
+        except quota.QuotaExceeded:
+            if not comments:
+                raise
+            break
         except HttpError as e:
+            if not _is_permanent(e):
+                raise
+            # TODO: logging
             print(e)
-            return comments
-
-        if response:
-            for item in response["items"]:
-                comment = item["snippet"]["topLevelComment"]
-                text = comment["snippet"]["textDisplay"]
-                comments.append(text)
-        else:
-            raise datatypes.DataFetchingError(kwargs["videoId"])
+            break
+        if not response:
+            raise datatypes.DataFetchingError(video_id)
             # TODO: catch
-
-        if "nextPageToken" in response:
-            kwargs["pageToken"] = response.get("nextPageToken")
-        else:
+        for comment in _parse_comments(response):
+            if comment[0] in known_ids:
+                return comments[:budget]
+            comments.append(comment)
+        if "nextPageToken" not in response:
             break
+        kwargs["pageToken"] = response["nextPageToken"]
+    else:
+        if len(comments) < budget and limit < timeout:
+            deadline.skip("comments")
+    return comments[:budget]
+
 
-    return comments
+def _merge_comments(new: List[Tuple[str, str]], previous: datatypes.Video,
+                    window: int) -> List[Tuple[str, str]]:
+    """Helper function to put the new comments in front of the snapshot of
+    the previous video, keeping the window first comments."""
+    new_ids = {comment_id for comment_id, _ in new}
+    kept = [comment for comment in zip(previous.comment_ids, previous.comments) if comment[0] not in new_ids]
+    return (new + kept)[:window]
 
 
 def _video_meta_by_id(client: Resource, **kwargs) -> List[Union[List[str], str]]:
@@ -121,100 +344,331 @@ def _video_meta_by_id(client: Resource, **kwargs) -> List[Union[List[str], str]]
     """
     kwargs = _remove_empty_kwargs(**kwargs)
 
-    response = client.videos().list(
+    response = _execute("videos.list", client.videos().list(
         **kwargs
-    ).execute()
+    ))
 
     if not response["items"]:
         raise datatypes.DataFetchingError(kwargs["id"])
         # TODO catch
 
+    return _parse_video_meta(response["items"][0])
+
+
+def _parse_video_meta(item: dict) -> List[Union[List[str], str]]:
+    """Helper function to pull the title, channel_id, channel_title, tags,
+    publication time and comment count out of one item of a videos.list
+    response.
+    """
     # meta data
-    title = response["items"][0]["snippet"]["title"]
-    channel_id = response["items"][0]["snippet"]["channelId"]
-    channel_title = response["items"][0]["snippet"]["channelTitle"]
-    tags = response["items"][0]["snippet"].get("tags")
-    return [title, channel_id, channel_title, tags]
+    title = item["snippet"]["title"]
+    channel_id = item["snippet"]["channelId"]
+    channel_title = item["snippet"]["channelTitle"]
+    tags = item["snippet"].get("tags")
+    published_at = _parse_timestamp(item["snippet"].get("publishedAt"))
+    comment_count = item.get("statistics", {}).get("commentCount")
+    return [title, channel_id, channel_title, tags, published_at,
+            int(comment_count) if comment_count is not None else None]
+
+
+def _parse_timestamp(timestamp: Optional[str]) -> Optional[datetime]:
+    """Helper function to parse a RFC 3339 timestamp of the API to a naive
+    UTC datetime."""
+    if not timestamp:
+        return None
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).replace(tzinfo=None)
 
 
-def video_data_aggregate(video_id: str) -> Optional[datatypes.Video]:
+def videos_meta_by_ids(video_ids: List[str]) \
+        -> Tuple[Dict[str, List[Union[List[str], str]]], Dict[str, HttpError]]:
+    """Function to retrieve the meta data of many videos, asking videos.list
+    for up to MAX_IDS_PER_VIDEOS_LIST ids per call. Returns a dict from video
+    id to its meta data, where ids that YouTube does not know are left out,
+    and a dict from the ids of the calls that failed to their error, which
+    are not known to be valid or not.
+    Raises quota.QuotaExceeded if a call is shed.
+    """
+    client = _init_service()
+    metas, failed = {}, {}
+    for start in range(0, len(video_ids), MAX_IDS_PER_VIDEOS_LIST):
+        group = video_ids[start:start + MAX_IDS_PER_VIDEOS_LIST]
+        try:
+            response = _execute("videos.list", client.videos().list(
+                part="snippet,statistics", id=",".join(group), maxResults=len(group)
+            ))
+        except HttpError as e:
+            # TODO: logging
+            print(e)
+            failed.update(dict.fromkeys(group, e))
+            continue
+        for item in response.get("items", []):
+            metas[item["id"]] = _parse_video_meta(item)
+    return metas, failed
+
+
+def video_data_aggregate(video_id: str, meta: Optional[list] = None, budget: int = MAX_NUMBER_COMMENTS,
+                         timeout: float = COMMENT_DEADLINE_SECONDS,
+                         previous: Optional[datatypes.Video] = None,
+                         deadline: Optional[datatypes.Deadline] = None) -> Optional[datatypes.Video]:
     """Facade function to gather information about the video and encapsulate to 
-    Video object.
+    Video object. meta, if given, is the already fetched meta data of the video;
+    at most budget comments are fetched within timeout seconds, and within
+    the deadline of the report if given. previous, if given, is the stored
+    snapshot of the video: only the comments posted since are fetched, and
+    merged into it.
     """
     client = _init_service()
     try:
         # gather meta data
-        meta = _video_meta_by_id(client, part="snippet", id=video_id)
-        comments = _get_comments(client, part="snippet", videoId=video_id,
-                                 maxResults=NUM_RESULTS_PER_REQUEST, pageToken="",
-                                 order="relevance", textFormat="plainText")
-        # guess language for the majority of the comments
-        lang = _detect_lang(comments)
-        # encapsulate
-        params = ["_id", "video_title", "channel_id",
-                  "channel_title", "tags", "comments", "lang"]
-        video_meta = [video_id] + meta + [comments] + [lang]
-        return datatypes.Video(**dict(zip(params, video_meta)))
+        if not meta:
+            meta = _video_meta_by_id(client, part="snippet,statistics", id=video_id)
+        if previous and previous.comment_ids:
+            new = _get_new_comments(client, video_id, set(previous.comment_ids), budget, timeout, deadline)
+            comments = _merge_comments(new, previous, budget)
+        else:
+            comments = _get_comments(client, video_id, budget, timeout, deadline)
+        comment_ids = [comment_id for comment_id, _ in comments]
+        comments = [text for _, text in comments]
+        return _new_video(video_id, meta, comments, comment_ids, _lang_distribution(comments))
     except datatypes.DataFetchingError as e:
         print(e)
         return None
         # TODO(harry) add logging module
 
 
-def _detect_lang(comments: List[str]) -> str:
-    """Helper function to detect the language of the comments.
+def video_report_stream(video_id: str, meta: Optional[list] = None, budget: int = MAX_NUMBER_COMMENTS,
+                        timeout: float = COMMENT_DEADLINE_SECONDS,
+                        deadline: Optional[datatypes.Deadline] = None,
+                        progress: Optional[Callable[[str], None]] = None) \
+        -> Tuple[Optional[datatypes.Video], Optional[datatypes.Report]]:
+    """Facade function to fetch the comments of the video and to analyze
+    them in one stream: each page is analyzed as soon as it arrives, while
+    the next ones are fetched, and its analyses are aggregated into the
+    report at once. meta, budget, timeout and deadline are as for
+    video_data_aggregate; progress, if given, is called with "analyzing"
+    when the first page is analyzed. Returns the video and its report.
     """
-    text = "".join(comments)
-    lang = langdetect.detect(text)
-    return lang
+    client = _init_service()
+    try:
+        if not meta:
+            meta = _video_meta_by_id(client, part="snippet,statistics", id=video_id)
+        comment_ids, comments = [], []
+
+        def chunks() -> Iterator[List[str]]:
+            for page in _stream_comments(client, video_id, budget, timeout, deadline):
+                comment_ids.extend(comment_id for comment_id, _ in page)
+                comments.extend(text for _, text in page)
+                if progress and len(comments) == len(page):
+                    progress("analyzing")
+                yield [text for _, text in page]
+
+        aggregate, _ = _analyze_chunks(chunks(), None, deadline)
+        video = _new_video(video_id, meta, comments, comment_ids, _lang_distribution(comments))
+        return video, _build_report(video, aggregate, deadline, budget)
+    except datatypes.DataFetchingError as e:
+        print(e)
+        return None, None
+        # TODO(harry) add logging module
+
+
+def _new_video(video_id: str, meta: list, comments: List[str], comment_ids: List[str],
+               lang_distribution: Dict[str, float]) -> datatypes.Video:
+    """Helper function to encapsulate the meta data and the comments of the
+    video to a Video object. Its language is the dominant one of
+    lang_distribution."""
+    # the distribution is ordered by share
+    lang = next(iter(lang_distribution), None)
+    params = ["_id", "video_title", "channel_id", "channel_title", "tags",
+              "published_at", "comment_count", "comments", "comment_ids", "lang", "lang_distribution"]
+    video_meta = [video_id] + meta + [comments] + [comment_ids] + [lang] + [lang_distribution]
+    return datatypes.Video(**dict(zip(params, video_meta)))
+
+
+def estimated_quota_units(budget: int = MAX_NUMBER_COMMENTS) -> int:
+    """Function returns the YouTube Data API quota units one analysis of
+    budget comments costs at most: one videos.list call, and one
+    commentThreads.list call per page; every ordering fetches its pages
+    concurrently, so each may fetch one page past the budget.
+    """
+    return 1 + math.ceil(budget / MAX_RESULTS_PER_PAGE) + len(COMMENT_ORDERS) - 1
+
+
+def warm_up() -> None:
+    """Function to load the language profiles of langdetect, which are
+    otherwise loaded on the first detection, and to build the YouTube client
+    with its pool of transports."""
+    _language_factory()
+    _youtube.warm_up()
+
+
+def youtube_stats() -> dict:
+    """Function returns the counters of the YouTube client."""
+    return _youtube.stats()
+
+
+def quota_stats() -> dict:
+    """Function returns the remaining quota of the upstream APIs."""
+    return quota.default_scheduler().stats()
+
+
+def analyzer_stats() -> dict:
+    """Function returns the counters of the comment analyzer."""
+    return analyzers.default_analyzer().stats()
+
+
+def _language_factory() -> DetectorFactory:
+    """Function returns the langdetect factory of the process, loading the
+    language profiles on the first call."""
+    global _lang_factory
+    with _lang_lock:
+        if _lang_factory is None:
+            factory = DetectorFactory()
+            factory.load_profile(PROFILES_DIRECTORY)
+            _lang_factory = factory
+    return _lang_factory
 
 
-def _extract_adjective(client: LanguageServiceClient, comments: List[str]) -> str:
-    """Function all to NLP to pull out all adjectives from the text.
+def _lang_distribution(comments: List[str]) -> Dict[str, float]:
+    """Function to identify the language of each comment of a sample of
+    LANG_SAMPLE_SIZE comments, drawn with a fixed seed so that the same
+    comments always give the same answer. Returns the share of the voting
+    comments in each language, the dominant language first; the dict is
+    empty if no comment can be identified.
     """
-    text = "".join(comments)
-    # if isinstance(text, six.binary_type):
-    #     text = text.encode("utf-8")
-
-    # instantiates a plain text document.
-    document = {
-        "type_": language.Document.Type.PLAIN_TEXT,
-        "content": text.encode("utf-8")
-    }
-
-    # decompose the text to tokens
-    tokens = client.analyze_syntax(
-        request={"document": document, "encoding_type": language.EncodingType.UTF8}).tokens
-
-    # results are store as list of tokens
-    adj_list = u""
-    for token in tokens:
-        # append all adjectives to result
-        part_of_speech_tag = language.PartOfSpeech.Tag(token.part_of_speech.tag)
-        if part_of_speech_tag.name == "ADJ":
-            adj_list += f"{token.text.content} "
-    return adj_list
-
-
-def _sentiment_analysis(client: LanguageServiceClient, text: str) -> Tuple[str, str]:
-    """detects sentiment in the text."""
-    length = text.count(" ") + 1
-
-    # instantiates a plain text document
-    document = {
-        "type_": language.Document.Type.PLAIN_TEXT,
-        "content": text
-    }
-
-    # detects sentiment in the document
-    sentiment = client.analyze_sentiment(
-        request={"document": document}).document_sentiment
-    if not sentiment:
+    voters = [comment for comment in comments if len(comment.strip()) >= MIN_LANG_CHARACTERS] or comments
+    if len(voters) > LANG_SAMPLE_SIZE:
+        voters = random.Random(LANG_SEED).sample(voters, LANG_SAMPLE_SIZE)
+    factory = _language_factory()
+    votes = Counter()
+    for comment in voters:
+        detector = factory.create()
+        detector.n_trial = LANG_TRIALS
+        detector.append(comment)
+        try:
+            votes[detector.detect()] += 1
+        except LangDetectException:
+            # e.g. only emojis
+            continue
+    total = sum(votes.values())
+    return {lang: count / total for lang, count in votes.most_common()}
+
+
+def _analysis_lang(lang_distribution: Dict[str, float]) -> Optional[str]:
+    """Function returns the language to analyze comments of lang_distribution
+    in: the dominant one the analyzer handles, if its share is at least
+    MIN_ANALYZED_SHARE, or else the dominant one."""
+    analyzer = analyzers.default_analyzer()
+    for lang, share in lang_distribution.items():
+        if share < MIN_ANALYZED_SHARE:
+            break
+        if analyzer.supports(lang):
+            return lang
+    return next(iter(lang_distribution), None)
+
+
+def _normalize_comment(comment: str) -> str:
+    """Helper function to normalize the text of a comment, so that copies of
+    a comment share their analysis."""
+    return " ".join(unicodedata.normalize("NFKC", comment).casefold().split())
+
+
+def _comment_key(comment: str, analyzer_name: str) -> str:
+    """Helper function returns the key of the comment in the comment analysis
+    cache."""
+    return hashlib.sha256(f"{analyzer_name}\0{_normalize_comment(comment)}".encode("utf-8")).hexdigest()
+
+
+def _analyze_chunks(chunks: Iterable[List[str]], lang: Optional[str],
+                    deadline: Optional[datatypes.Deadline] = None) \
+        -> Tuple[datatypes.ReportAggregate, Optional[str]]:
+    """Function to analyze the comments chunk by chunk, as the chunks are
+    produced, and to aggregate the analyses. The comments of a chunk found
+    in the comment analysis cache are not sent to the analyzer. At most
+    ANALYSIS_MAX_IN_FLIGHT chunks are analyzed at once; the next chunk is
+    only pulled when one of them is done, which holds back its producer.
+    lang None means the language of the first chunk, see _analysis_lang. The
+    chunks the analyzer did not finish within the deadline, if given, are
+    left out, and so are all of them if the analyzer does not handle the
+    language, rather than being scored as neutral. Returns the aggregate, and the language.
+    """
+    analyzer = analyzers.default_analyzer()
+    aggregate = datatypes.ReportAggregate()
+    pending = deque()
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if lang is None:
+            lang = _analysis_lang(_lang_distribution(chunk))
+        if not analyzer.supports(lang):
+            # e.g. the local analyzer and comments in another language
+            aggregate.unsupported += len(chunk)
+            continue
+        if len(pending) >= ANALYSIS_MAX_IN_FLIGHT:
+            _aggregate_chunk(aggregate, analyzer, *pending.popleft(), deadline)
+        pending.append(_start_chunk(analyzer, chunk, lang))
+    while pending:
+        _aggregate_chunk(aggregate, analyzer, *pending.popleft(), deadline)
+    return aggregate, lang
+
+
+def _start_chunk(analyzer: analyzers.Analyzer, comments: List[str], lang: str) -> tuple:
+    """Helper function to look the comments up in the comment analysis cache
+    and to start the analysis of the others. Returns the comments, their
+    keys, the analyses found, and the running analysis or None."""
+    keys = [_comment_key(comment, analyzer.name) for comment in comments]
+    found = db.DBM.select_comment_analyses(list(dict.fromkeys(keys)))
+    missing = {}
+    for key, comment in zip(keys, comments):
+        if key not in found and key not in missing:
+            missing[key] = comment
+    future = None
+    if missing:
+        # the analyzer runs in the quota priority class of the caller, on its threads
+        future = _analysis_pools[quota.current_priority()].submit(contextvars.copy_context().run,
+                                                                  _analyze_missing, analyzer, missing, lang)
+    return comments, keys, found, future
+
+
+def _analyze_missing(analyzer: analyzers.Analyzer, missing: Dict[str, str],
+                     lang: str) -> Dict[str, datatypes.CommentAnalysis]:
+    """Helper function to analyze the comments of the dict from key to
+    comment, and return the dict from key to analysis."""
+    return dict(zip(missing, analyzer.analyze(list(missing.values()), lang)))
+
+
+def _aggregate_chunk(aggregate: datatypes.ReportAggregate, analyzer: analyzers.Analyzer, comments: List[str],
+                     keys: List[str], found: Dict[str, datatypes.CommentAnalysis], future,
+                     deadline: Optional[datatypes.Deadline]) -> None:
+    """Helper function to wait for the analysis of a chunk, until the
+    deadline if given, to cache the new analyses and to aggregate them. The
+    comments whose analysis is not done by then are left out; the analyzer
+    is left to finish in the background."""
+    distinct = len(set(keys))
+    aggregate.distinct += distinct
+    if future is None:
+        aggregate.cached += distinct
+    else:
+        try:
+            fresh = future.result(timeout=deadline.remaining() if deadline else None)
+        except TimeoutError:
+            deadline.skip("analysis")
+            fresh = {}
+        # analyses of a fallback analyzer are not kept under the name of the analyzer
+        db.DBM.add_comment_analyses({key: analysis for key, analysis in fresh.items()
+                                     if analysis.analyzer == analyzer.name})
+        aggregate.cached += len(found)
+        found.update(fresh)
+    for key, comment in zip(keys, comments):
+        if key in found:
+            aggregate.add(comment, found[key])
+
+
+def _sentiment_analysis(score: Optional[float], magnitude: float, length: int) -> Tuple[str, str]:
+    """Function to describe the sentiment of a text of length words, given
+    its score and magnitude."""
+    if score is None:
         return "", ""
     else:
-        score = sentiment.score
-        magnitude = sentiment.magnitude
-
         saturation = magnitude / length > 0.1
 
         if score <= SCORE_SCALE[0]:
@@ -234,79 +688,84 @@ def _sentiment_analysis(client: LanguageServiceClient, text: str) -> Tuple[str,
             return "Reviews are complimenting!", "&#x1f604"
 
 
-def _generate_word_cloud(filename: str, text: str, lang: str) -> str:
-    """Function to generate word cloud and returns the absolute path to the image.
+def _generate_word_cloud(word_freq: Dict[str, int], lang: str, timeout: Optional[float] = None) -> str:
+    """Function to generate word cloud of the word frequencies in the renderer
+    pool, store the png image in the image store and returns its digest, or
+    "" if the image was not rendered within timeout seconds.
     """
-    if not text:
+    if not word_freq:
         return ""
-    # extend to file file path
-    this_path = os.path.abspath(os.path.dirname(__file__))
+    png = render.default_renderer().render(word_freq, lang, timeout)
+    if png is None:
+        return ""
+    return blobstore.default_store().put(png)
 
-    stopwords_file = os.path.join(this_path, PATH_TO_STOPWORDS.format(
-        rf"{['en', 'zh-cn'][lang == 'zh-cn']}"))
-    file_out_path = os.path.join(this_path, PATH_TO_IMG.format(filename))
-    # bg_image_path = os.path.join(this_path, r"..\dat\wcloud_bg.jpg")
 
-    if lang == "zh-cn":
-        font_path = os.path.join(this_path, PATH_TO_FONTS.format(CH_FONT))
-    else:
-        font_path = os.path.join(this_path, PATH_TO_FONTS.format(EN_FONT))
-
-    # background_image = plt.imread(bg_image_path)
-    # fetch all stopwords
-    stopwords = set("")
-    if lang == "en":
-        with open(stopwords_file) as file:
-            words = [word.rstrip() for word in file.readlines()]
-        stopwords.update(words)
-
-    wc = WordCloud(
-        background_color=None,
-        mode="RGBA",
-        font_path=font_path,
-        max_words=2000,
-        width=1000,
-        height=800,
-        max_font_size=150,
-        random_state=10,
-        stopwords=stopwords
-    )
-
-    wc.generate_from_text(text)
-
-    # process_word = WordCloud.process_text(wc, text)
-    # sorted_keywords = sorted(process_word.items(), key=lambda e: e[1], reverse=True)
-    # print(sorted_keywords[:50])
-    # img_colors = ImageColorGenerator(background_image)
-    # wc.recolor(color_func=img_colors)
-
-    wc.to_file(file_out_path)
-
-    abs_path_to_img = os.path.join(this_path, PATH_TO_IMG.format(filename))
-
-    return abs_path_to_img
-
-
-def get_report(video: datatypes.Video) -> Optional[datatypes.Report]:
-    """Facade function to get sentiment analysis report and to get the path to
-    the word-cloud image.
+def file_digest(path: str) -> str:
+    """Function to compute the sha256 hex digest of the file at path."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_report(video: datatypes.Video, deadline: Optional[datatypes.Deadline] = None,
+               budget: int = MAX_NUMBER_COMMENTS) -> Optional[datatypes.Report]:
+    """Facade function to get sentiment analysis report and to store the
+    word-cloud image. The comments not in the cache are analyzed in one
+    call, which the analyzer may split into documents analyzed at once.
+    Given a deadline, the comments not analyzed in time are left out, see
+    _build_report.
     """
-    if not video.lang:
+    lang = _analysis_lang(video.lang_distribution) if video.lang_distribution else video.lang
+    aggregate, _ = _analyze_chunks([video.comments], lang, deadline)
+    return _build_report(video, aggregate, deadline, budget)
+
+
+def _build_report(video: datatypes.Video, aggregate: datatypes.ReportAggregate,
+                  deadline: Optional[datatypes.Deadline] = None,
+                  budget: int = MAX_NUMBER_COMMENTS) -> datatypes.Report:
+    """Helper function to make the report of the video from the aggregate of
+    the analyses of its comments, with the frequency table of their
+    adjectives, and to store the word-cloud image rendered from it. Given a
+    deadline, the word cloud is left out if less than WCLOUD_RESERVE_SECONDS
+    remain or if it is not rendered before the deadline; a report the
+    deadline cut short is marked partial, with the
+    share of the budget comments it covers. Without comments, e.g. when the
+    deadline ends before the first page arrives, the report has no attitude
+    and no word cloud; so has a report whose comments are in a language the
+    analyzer does not handle, which is marked not analyzed.
+    """
+    if video.comments and not video.lang:
         raise AttributeError(f"Error: video(id: {video.get_id()}) language is not set.")
         # TODO: catch
-    # acquire nlp client
-    nlp = language.LanguageServiceClient()
-
-    adj_list = _extract_adjective(nlp, video.comments)
-    attitude, emoji = _sentiment_analysis(nlp, " ".join(video.comments))
-    wcloud_img_path = _generate_word_cloud(video.get_id(), adj_list, video.lang)
-
-    if not wcloud_img_path:
-        wcloud_img_path = None
-
-    init_dict = dict(zip(["_id", "video_title", "attitude", "emoji", "wcloud", "tags"],
-                         [video.get_id(), video.video_title, attitude, emoji, wcloud_img_path,
-                          video.tags]))
+    attitude, emoji = _sentiment_analysis(aggregate.score(), aggregate.magnitude, max(aggregate.words, 1))
+    word_freq = aggregate.word_freq(render.stopwords(video.lang), render.MAX_WORDS)
+    if not video.comments:
+        wcloud_hash = None
+    elif deadline and deadline.remaining() < WCLOUD_RESERVE_SECONDS:
+        deadline.skip("wcloud")
+        wcloud_hash = None
+    else:
+        # the image is content addressed, so its key is its hash too
+        wcloud_hash = _generate_word_cloud(word_freq, video.lang,
+                                           deadline.remaining() if deadline else None) or None
+        if deadline and wcloud_hash is None and deadline.remaining() <= 0:
+            deadline.skip("wcloud")
+
+    partial = bool(deadline and deadline.skipped)
+    expected = len(video.comments)
+    if partial and "comments" in deadline.skipped:
+        expected = max(expected, min(budget, video.comment_count or budget))
+    coverage = aggregate.comments / expected if expected else 1.0
+
+    analyzed = not (aggregate.unsupported and not aggregate.comments)
+
+    init_dict = dict(zip(["_id", "video_title", "attitude", "emoji", "wcloud", "wcloud_hash", "tags",
+                          "cache_hit_rate", "partial", "coverage", "analyzed", "word_freq"],
+                         [video.get_id(), video.video_title, attitude, emoji, wcloud_hash, wcloud_hash,
+                          video.tags, aggregate.hit_rate(), partial, coverage, analyzed, word_freq]))
     return datatypes.Report(**init_dict)
 
 
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Emotional-YouTube Write-behind Queue of the Database
+Jan(Zhan) Lu and Haoyan Wang, Winter 2020
+
+This code is provided for non-commercial and study purpose.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, should conform to the open source licence as provided.
+
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+# attempts to write a row before it is dropped
+MAX_ATTEMPTS = 3
+
+
+class WriteBehind:
+    """Queue of pending upserts written by a single writer thread. The thread
+    wakes up on the first pending row, waits interval seconds for more rows to
+    gather, and writes up to max_batch rows in one transaction. A newer row
+    for the same key replaces the pending one. Rows stay readable through
+    get() until their transaction has committed. A failed transaction is
+    split in halves written on their own, down to single rows, so that a
+    row that cannot be written does not fail the others; it is retried up
+    to MAX_ATTEMPTS times, then dropped and passed to on_drop.
+
+    === Attributes ===
+    interval : seconds to gather rows before a batch is written;
+    max_batch: maximum number of rows per transaction.
+    """
+
+    interval: float
+    max_batch: int
+
+    def __init__(self, write: Callable[[List[dict]], None], interval: float = 0.005,
+                 max_batch: int = 500, on_drop: Optional[Callable[[str, dict], None]] = None):
+        self.interval = interval
+        self.max_batch = max_batch
+        self._write = write
+        self._on_drop = on_drop
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._wakeup = threading.Event()
+        self._pending: "OrderedDict[str, dict]" = OrderedDict()
+        self._writing: Dict[str, dict] = {}
+        self._attempts: Dict[str, int] = {}
+        self._thread = None
+        self._stopping = False
+        self._batches = 0
+        self._rows = 0
+        self._failures = 0
+        self._dropped = 0
+        self._commit_seconds = 0.0
+        self._last_commit_seconds = 0.0
+        self._max_commit_seconds = 0.0
+
+    def put(self, key: str, row: dict) -> None:
+        """Queue the upsert of row under key."""
+        with self._lock:
+            self._pending.pop(key, None)
+            self._pending[key] = row
+            self._attempts.pop(key, None)
+            # started lazily, so that a process forked after import gets its own
+            if not self._thread or not self._thread.is_alive():
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the row queued or being written under key, or None."""
+        with self._lock:
+            return self._pending.get(key) or self._writing.get(key)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every queued row is written; returns False on timeout."""
+        self._wakeup.set()
+        with self._lock:
+            if not self._thread or not self._thread.is_alive():
+                return not self._pending
+            return self._drained.wait_for(lambda: not self._pending and not self._writing, timeout)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Write the queued rows and stop the writer thread."""
+        self.flush(timeout)
+        with self._lock:
+            self._stopping = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread:
+            thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                if self._stopping and not self._pending:
+                    return
+            # let the rows of concurrent requests gather into the batch
+            time.sleep(self.interval)
+            self._wakeup.clear()
+            with self._lock:
+                keys = list(self._pending)[:self.max_batch]
+                for key in keys:
+                    self._writing[key] = self._pending.pop(key)
+                batch = {key: self._writing[key] for key in keys}
+            if batch:
+                self._commit(batch)
+            with self._lock:
+                if self._pending or self._stopping:
+                    self._wakeup.set()
+                self._drained.notify_all()
+
+    def _commit(self, batch: Dict[str, dict]) -> None:
+        failed = self._write_split(list(batch.items()))
+        dropped = []
+        with self._lock:
+            for key, row in batch.items():
+                del self._writing[key]
+                if key not in failed or key in self._pending:
+                    # written, or replaced by a newer row meanwhile
+                    self._attempts.pop(key, None)
+                    continue
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts < MAX_ATTEMPTS:
+                    self._attempts[key] = attempts
+                    self._pending[key] = row
+                else:
+                    print(f"Write-behind dropped the row of {key} after {attempts} attempts")
+                    self._attempts.pop(key, None)
+                    self._dropped += 1
+                    dropped.append((key, row))
+        if self._on_drop:
+            for key, row in dropped:
+                self._on_drop(key, row)
+
+    def _write_split(self, rows: List[tuple]) -> set:
+        """Write the (key, row) pairs in one transaction; if it fails, write
+        each half on its own, down to single rows. Returns the keys of the
+        rows that could not be written."""
+        start = time.perf_counter()
+        try:
+            self._write([row for _, row in rows])
+        except Exception as e:
+            # TODO: logging
+            print(f"Write-behind commit of {len(rows)} rows failed: {e}")
+            with self._lock:
+                self._failures += 1
+            if len(rows) == 1:
+                return {rows[0][0]}
+            middle = len(rows) // 2
+            return self._write_split(rows[:middle]) | self._write_split(rows[middle:])
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._batches += 1
+            self._rows += len(rows)
+            self._commit_seconds += elapsed
+            self._last_commit_seconds = elapsed
+            self._max_commit_seconds = max(self._max_commit_seconds, elapsed)
+        return set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": len(self._pending),
+                "writing": len(self._writing),
+                "batches": self._batches,
+                "rows": self._rows,
+                "failures": self._failures,
+                "dropped": self._dropped,
+                "avg_commit_ms": 1000 * self._commit_seconds / self._batches if self._batches else 0.0,
+                "last_commit_ms": 1000 * self._last_commit_seconds,
+                "max_commit_ms": 1000 * self._max_commit_seconds
+            }
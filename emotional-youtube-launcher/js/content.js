@@ -1,4 +1,5 @@
-const URL = "http://127.0.0.1:5000/analysis/";
+const SERVER = "http://127.0.0.1:5000";
+const URL = SERVER + "/analysis/";
 const NO_RESULT = "No result available for this video.";
 
 function removeOldTags() {
@@ -17,10 +18,10 @@ function displayResponse() {
             return;
         }
         document.getElementById("report").innerHTML = responseObj.attitude + responseObj.emoji;
-        if (responseObj.wcloud === null) {
+        if (responseObj.wcloud_url === null) {
             document.getElementById("wcloud").src = "../images/well.png";
         } else {
-            document.getElementById("wcloud").src = "data:image/png;base64," + responseObj.wcloud;
+            document.getElementById("wcloud").src = SERVER + responseObj.wcloud_url;
         }
         var container = document.getElementsByClassName("flex-container")[0];
         for (tag in responseObj.tags) {
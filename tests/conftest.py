@@ -0,0 +1,48 @@
+"""Test setup: the backend talks to local stand-ins of the upstream servers
+and keeps its database in a temporary directory. The environment is set
+before the backend is imported, since it is read on import."""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from standins import YouTubeStandIn
+
+_youtube = YouTubeStandIn().start()
+_tmp = tempfile.mkdtemp(prefix="emotional-youtube-tests-")
+
+os.environ["GCP_APIKEY_EmotionalYouTube"] = "test-key"
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.devnull
+os.environ["YOUTUBE_API_ENDPOINT"] = _youtube.url
+os.environ["EMOTIONAL_YOUTUBE_ANALYZER"] = "local"
+os.environ["EMOTIONAL_YOUTUBE_DATABASE_URI"] = "sqlite:///" + os.path.join(_tmp, "db.sqlite")
+os.environ["EMOTIONAL_YOUTUBE_QUOTA_STATE_PATH"] = os.path.join(_tmp, "quota.json")
+os.environ.pop("EMOTIONAL_YOUTUBE_REDIS_URL", None)
+
+
+@pytest.fixture
+def youtube():
+    """The YouTube Data API stand-in the backend is pointed at, emptied."""
+    _youtube.reset()
+    yield _youtube
+    _youtube.reset()
+
+
+@pytest.fixture
+def client():
+    """Test client of the app."""
+    from backend import app
+
+    return app.app.test_client()
+
+
+@pytest.fixture
+def no_word_cloud(monkeypatch):
+    """Leave the reports without a word cloud, so that no renderer starts."""
+    from backend import utils
+
+    monkeypatch.setattr(utils, "_generate_word_cloud", lambda *args: "")
@@ -0,0 +1,165 @@
+"""Local stand-ins of the upstream servers, run in the test process."""
+
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class YouTubeStandIn:
+    """YouTube Data API stand-in serving videos.list and commentThreads.list.
+
+    videos maps a video id to its meta data, comments maps a video id to its
+    (comment id, text) pairs, newest first, errors maps a method name
+    ("videos" or "commentThreads") to the http status it answers with, or
+    to a (status, reason) pair, the reason being quotaExceeded otherwise, and
+    delays maps a method name to the seconds it takes to answer. Every call
+    is recorded in calls as (method, query).
+    """
+
+    def __init__(self):
+        self.videos = {}
+        self.comments = {}
+        self.errors = {}
+        self.delays = {}
+        self.calls = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = "http://127.0.0.1:%d/" % self._server.server_address[1]
+
+    def start(self) -> "YouTubeStandIn":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def reset(self) -> None:
+        self.videos.clear()
+        self.comments.clear()
+        self.errors.clear()
+        self.delays.clear()
+        self.calls.clear()
+
+    def add_video(self, video_id, comments, title="Title"):
+        """Add a video with its comments, given newest first."""
+        self.videos[video_id] = {
+            "id": video_id,
+            "snippet": {"title": title, "channelId": "channel", "channelTitle": "Channel",
+                        "tags": ["tag"], "publishedAt": "2020-01-01T00:00:00Z"},
+            "statistics": {"commentCount": str(len(comments))}
+        }
+        self.comments[video_id] = list(comments)
+
+    def _answer(self, method, query):
+        self.calls.append((method, query))
+        time.sleep(self.delays.get(method, 0))
+        if method in self.errors:
+            status, reason = self.errors[method] if isinstance(self.errors[method], tuple) \
+                else (self.errors[method], "quotaExceeded")
+            return status, {"error": {"code": status, "message": "stand-in error",
+                                      "errors": [{"reason": reason, "message": "stand-in error"}]}}
+        if method == "videos":
+            ids = query["id"][0].split(",")
+            return 200, {"items": [self.videos[vid] for vid in ids if vid in self.videos]}
+        comments = self.comments.get(query["videoId"][0], [])
+        if query.get("order", ["time"])[0] == "relevance":
+            comments = sorted(comments)
+        size = int(query.get("maxResults", ["100"])[0])
+        start = int(query.get("pageToken", ["0"])[0])
+        body = {"items": [{"id": comment_id,
+                           "snippet": {"topLevelComment": {"snippet": {"textDisplay": text}}}}
+                          for comment_id, text in comments[start:start + size]]}
+        if start + size < len(comments):
+            body["nextPageToken"] = str(start + size)
+        return 200, body
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                status, body = standin._answer(url.path.rstrip("/").rsplit("/", 1)[-1], parse_qs(url.query))
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+class RedisStandIn:
+    """Server speaking the Redis protocol (RESP), with the commands used by
+    the Redis tier: AUTH, SELECT, MGET, SET with EX, and DEL."""
+
+    def __init__(self, password=None):
+        self.password = password
+        self.data = {}
+        self.commands = []
+        self._lock = threading.Lock()
+        self._server = ThreadingTCPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+
+    def start(self) -> "RedisStandIn":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def url(self, database=0):
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}127.0.0.1:{self.port}/{database}"
+
+    def _execute(self, command, args):
+        with self._lock:
+            self.commands.append(command)
+            now = time.monotonic()
+            if command == "AUTH":
+                return b"+OK\r\n" if args[0].decode() == self.password else b"-WRONGPASS invalid password\r\n"
+            if command == "SELECT":
+                return b"+OK\r\n"
+            if command == "MGET":
+                values = []
+                for key in args:
+                    value, expires = self.data.get(key, (None, None))
+                    values.append(value if expires is None or expires > now else None)
+                return b"*%d\r\n" % len(values) + b"".join(
+                    b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value) for value in values)
+            if command == "SET":
+                expires = now + int(args[3]) if len(args) > 3 and args[2].upper() == b"EX" else None
+                self.data[args[0]] = (args[1], expires)
+                return b"+OK\r\n"
+            if command == "DEL":
+                return b":%d\r\n" % sum(self.data.pop(key, None) is not None for key in args)
+            return b"-ERR unknown command\r\n"
+
+    def _handler(self):
+        standin = self
+
+        class Handler(StreamRequestHandler):
+            def handle(self):
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    parts = []
+                    for _ in range(int(line[1:])):
+                        length = int(self.rfile.readline()[1:])
+                        parts.append(self.rfile.read(length + 2)[:-2])
+                    try:
+                        self.wfile.write(standin._execute(parts[0].decode().upper(), parts[1:]))
+                    except socket.error:
+                        return
+
+        return Handler
@@ -0,0 +1,27 @@
+import pytest
+
+pytestmark = pytest.mark.usefixtures("no_word_cloud")
+
+FRENCH = [("f1", "Cette vidéo est vraiment magnifique, merci beaucoup pour le travail"),
+          ("f2", "Je ne comprends pas pourquoi le son est aussi mauvais dans cette partie"),
+          ("f3", "La musique de fond est très agréable et les images sont superbes")]
+
+
+def test_unsupported_language_is_not_scored_neutral(client, youtube):
+    # the tests run the local analyzer, which handles English only
+    youtube.add_video("language001", FRENCH)
+
+    body = client.get("/analysis/language001").get_json()
+
+    assert body["analyzed"] is False
+    assert body["attitude"] == "" and body["emoji"] == ""
+
+
+def test_supported_language_is_analyzed(client, youtube):
+    youtube.add_video("language002", [("e1", "What a great and wonderful video, thank you"),
+                                      ("e2", "Awful sound, I really hated the terrible ending")])
+
+    body = client.get("/analysis/language002").get_json()
+
+    assert "analyzed" not in body
+    assert body["attitude"]
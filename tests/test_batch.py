@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from backend import db, utils
+
+pytestmark = pytest.mark.usefixtures("no_word_cloud")
+
+
+def _batch(client, ids):
+    response = client.post("/analysis/batch", json={"ids": ids})
+    assert response.status_code == 200
+    return {line["video_id"]: line for line in map(json.loads, response.get_data(as_text=True).splitlines())}
+
+
+def test_failed_meta_call_is_not_recorded_invalid(client, youtube):
+    youtube.add_video("batch000001", [("c1", "great video")])
+    youtube.errors["videos"] = 500
+
+    lines = _batch(client, ["batch000001", "batch000002"])
+
+    assert all(line["report"] == {} and "error" in line for line in lines.values())
+    assert not db.DBM.lookup("batch000001").exists
+    assert not db.DBM.lookup("batch000002").exists
+
+    del youtube.errors["videos"]
+    lines = _batch(client, ["batch000001", "batch000002"])
+
+    assert lines["batch000001"]["report"]["video_title"] == "Title"
+    assert "error" not in lines["batch000001"]
+    assert client.get("/analysis/batch000001").get_json()["video_title"] == "Title"
+    # left out of a successful response: recorded as invalid
+    assert lines["batch000002"] == {"video_id": "batch000002", "report": {}}
+    entry = db.DBM.lookup("batch000002")
+    assert entry.exists and entry.report is None
+
+
+def test_meta_is_fetched_per_group(youtube, monkeypatch):
+    monkeypatch.setattr(utils, "MAX_IDS_PER_VIDEOS_LIST", 2)
+    for vid in ("group000001", "group000002", "group000003"):
+        youtube.add_video(vid, [])
+
+    metas, failed = utils.videos_meta_by_ids(["group000001", "group000002", "group000003", "group000004"])
+
+    assert sorted(metas) == ["group000001", "group000002", "group000003"]
+    assert failed == {}
+    assert [method for method, _ in youtube.calls] == ["videos", "videos"]
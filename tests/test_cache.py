@@ -0,0 +1,90 @@
+import time
+from datetime import datetime
+
+import pytest
+from sqlalchemy import exc
+
+from backend import app, cache, datatypes, db  # noqa: F401, the app binds the database
+from standins import RedisStandIn
+
+
+@pytest.fixture
+def redis():
+    server = RedisStandIn(password="secret").start()
+    yield server
+    server.stop()
+
+
+def test_redis_round_trip(redis):
+    tier = cache.RedisTier(redis.url(database=2), ttl=60)
+    entry = {"report": "report", "latest_update": datetime(2024, 1, 1)}
+
+    assert tier.get("video") is None
+    assert tier.put("video", entry)
+    assert tier.get("video") == entry
+    assert tier.get_many(["video", "other"]) == {"video": entry}
+
+    tier.delete("video")
+    assert tier.get("video") is None
+    assert redis.commands[:2] == ["AUTH", "SELECT"]
+    assert tier.stats()["errors"] == 0
+
+
+def test_redis_entries_expire(redis):
+    tier = cache.RedisTier(redis.url(), ttl=1)
+    tier.put("video", {"report": "report"})
+    assert tier.get("video") == {"report": "report"}
+
+    time.sleep(1.1)
+
+    assert tier.get("video") is None
+
+
+def test_redis_failure_is_a_miss(redis):
+    tier = cache.RedisTier(f"redis://:wrong@127.0.0.1:{redis.port}/0")
+
+    assert not tier.put("video", {"report": "report"})
+    assert tier.get("video") is None
+    assert tier.stats()["errors"] == 1
+    # skipped without a call for RETRY_SECONDS
+    assert not tier.put("video", {"report": "report"})
+    assert redis.commands == ["AUTH"]
+
+
+class _FailingTier(cache.CacheTier):
+    def __init__(self):
+        super().__init__("failing")
+
+    def get(self, key):
+        return None
+
+    def put(self, key, value):
+        return False
+
+    def delete(self, key):
+        pass
+
+
+def test_failed_backing_write_is_not_cached():
+    memory = cache.MemoryTier()
+    tiered = cache.TieredCache([memory, _FailingTier()])
+
+    assert not tiered.put("video", {"report": "report"})
+    assert memory.get("video") is None
+
+
+def test_failed_database_write_is_not_served(monkeypatch):
+    written = []
+    monkeypatch.setattr(db.DBM, "_write_listeners", [lambda vid, latest_update: written.append(vid)])
+
+    def fail(rows):
+        raise exc.OperationalError("INSERT", {}, Exception("disk I/O error"))
+
+    monkeypatch.setattr(db.DBM, "_upsert_entries", fail)
+    report = datatypes.Report(_id="unstored001", video_title="T", attitude="a", emoji="e", wcloud=None, tags=[])
+
+    entry = db.DBM.add_entry_to_db("unstored001", None, report)
+
+    assert entry.report is report and not entry.stored
+    assert written == []
+    assert not db.DBM.lookup("unstored001").exists
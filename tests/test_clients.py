@@ -0,0 +1,52 @@
+import pytest
+from googleapiclient.errors import HttpError
+
+from backend import clients, utils
+
+
+@pytest.fixture
+def manager(youtube):
+    return clients.ClientManager("test-key", endpoint=youtube.url, pool_size=2,
+                                 discovery_path="/nonexistent/youtube.v3.json")
+
+
+def test_builds_from_bundled_discovery_document(manager):
+    # the discovery path is missing, so the document bundled with the client is used
+    assert manager.youtube() is manager.youtube()
+    assert manager.stats()["built"]
+
+
+def test_executes_against_endpoint_and_reuses_connections(manager, youtube):
+    youtube.add_video("video00001", [("c1", "nice")], title="First")
+    for _ in range(3):
+        response = manager.execute(manager.youtube().videos().list(part="snippet", id="video00001"))
+        assert response["items"][0]["snippet"]["title"] == "First"
+    assert [method for method, _ in youtube.calls] == ["videos"] * 3
+    assert youtube.calls[0][1]["key"] == ["test-key"]
+    stats = manager.stats()
+    assert stats["requests"] == 3
+    assert stats["transports_created"] == 1
+    assert stats["connections_reused"] == 2
+
+
+def test_error_status_raises_http_error(manager, youtube):
+    youtube.errors["videos"] = 403
+    with pytest.raises(HttpError) as error:
+        manager.execute(manager.youtube().videos().list(part="snippet", id="video00001"))
+    assert error.value.resp.status == 403
+    # the transport is returned to the pool
+    assert manager.stats()["transports_idle"] == 1
+
+
+def test_warm_up_fills_pool(manager):
+    manager.warm_up()
+    assert manager.stats()["transports_idle"] == manager.pool_size
+
+
+def test_process_client_uses_endpoint(youtube):
+    youtube.add_video("video00002", [("c2", "great video"), ("c1", "nice")])
+    meta = utils._video_meta_by_id(utils._init_service(), part="snippet,statistics", id="video00002")
+    assert meta[0] == "Title"
+    assert meta[-1] == 2
+    comments = utils._get_comments(utils._init_service(), "video00002", budget=10, timeout=5)
+    assert sorted(comments) == [("c1", "nice"), ("c2", "great video")]
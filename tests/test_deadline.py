@@ -0,0 +1,28 @@
+import time
+
+import pytest
+
+from backend import app, db
+
+pytestmark = pytest.mark.usefixtures("no_word_cloud")
+
+
+def test_deadline_before_first_page(client, youtube, monkeypatch):
+    monkeypatch.setitem(app.app.config, "REPORT_DEADLINE_SECONDS", 4)
+    youtube.add_video("deadline001", [("c1", "great video"), ("c2", "awful sound")])
+    youtube.delays["commentThreads"] = 3
+
+    response = client.get("/analysis/deadline001")
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["partial"] is True and body["coverage"] == 0
+    assert body["attitude"] == "" and body["wcloud_url"] is None
+
+    # completed by the background job, which has no deadline
+    youtube.delays.clear()
+    stop = time.monotonic() + 15
+    while db.DBM.lookup("deadline001").report.partial and time.monotonic() < stop:
+        time.sleep(0.1)
+    report = db.DBM.lookup("deadline001").report
+    assert not report.partial and report.attitude
@@ -0,0 +1,28 @@
+import threading
+import time
+
+from backend import jobs
+
+
+def test_video_with_an_active_job_gets_that_job():
+    release = threading.Event()
+    manager = jobs.JobManager(lambda job: release.wait(5), max_workers=2)
+
+    first = manager.submit("dedupe00001")
+    second = manager.submit("dedupe00001")
+    other = manager.submit("dedupe00002")
+
+    assert second is first and other is not first
+    assert manager.is_active("dedupe00001")
+    assert manager.stats()["submitted"] == 2 and manager.stats()["deduplicated"] == 1
+
+    release.set()
+    stop = time.monotonic() + 5
+    while manager.is_active("dedupe00001") and time.monotonic() < stop:
+        time.sleep(0.01)
+    assert first.status == jobs.DONE
+
+    # a finished job is not reused
+    assert manager.submit("dedupe00001") is not first
+    assert manager.stats()["submitted"] == 3 and manager.stats()["deduplicated"] == 1
+    manager.shutdown()
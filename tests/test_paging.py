@@ -0,0 +1,38 @@
+import threading
+
+from backend import quota, utils
+
+
+def test_bulk_work_does_not_starve_interactive_fetch(youtube):
+    youtube.add_video("paging00001", [("c1", "great video"), ("c2", "awful sound")])
+    release = threading.Event()
+    # a running batch holds every paging thread of its class
+    blocked = [utils._paging_pools[quota.BULK].submit(release.wait) for _ in range(utils.PAGING_WORKERS)]
+    try:
+        comments = utils._get_comments(utils._init_service(), "paging00001", timeout=2)
+    finally:
+        release.set()
+
+    assert sorted(comments) == [("c1", "great video"), ("c2", "awful sound")]
+    assert all(future.result(timeout=1) for future in blocked)
+
+
+def test_orderings_that_overlap_give_distinct_comments(youtube):
+    # newest first; the relevance ordering of the stand-in is by text, the reverse
+    comments = [(f"c{i:03}", f"comment {999 - i:03}") for i in range(250)]
+    youtube.add_video("paging00002", comments)
+
+    fetched = utils._get_comments(utils._init_service(), "paging00002", budget=150, timeout=5)
+
+    ids = [comment_id for comment_id, _ in fetched]
+    assert len(ids) == 150 and len(set(ids)) == 150
+    assert set(fetched) <= set(comments)
+
+
+def test_orderings_of_a_short_video_give_each_comment_once(youtube):
+    comments = [(f"c{i:03}", f"comment {i:03}") for i in range(50)]
+    youtube.add_video("paging00003", comments)
+
+    fetched = utils._get_comments(utils._init_service(), "paging00003", budget=100, timeout=5)
+
+    assert sorted(fetched) == comments
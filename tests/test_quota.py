@@ -0,0 +1,55 @@
+import pytest
+
+from backend import quota
+
+NO_RESERVES = {level: 0.0 for level in quota.PRIORITIES}
+NO_WAITS = {level: 0.0 for level in quota.PRIORITIES}
+
+
+def _bucket(path):
+    # one unit a day, so that nothing is refilled during a test
+    return quota.TokenBucket(10, 1 / 86400, NO_RESERVES, NO_WAITS, "youtube", path and str(path))
+
+
+def test_processes_share_the_bucket(tmp_path):
+    first, second = _bucket(tmp_path / "quota.json"), _bucket(tmp_path / "quota.json")
+
+    first.acquire(6, quota.INTERACTIVE)
+
+    with pytest.raises(quota.QuotaExceeded):
+        second.acquire(6, quota.INTERACTIVE)
+    second.acquire(4, quota.INTERACTIVE)
+    assert first.stats()["remaining"] == 0
+
+
+def test_restart_keeps_the_bucket(tmp_path):
+    _bucket(tmp_path / "quota.json").acquire(10, quota.INTERACTIVE)
+
+    restarted = _bucket(tmp_path / "quota.json")
+
+    with pytest.raises(quota.QuotaExceeded):
+        restarted.acquire(1, quota.INTERACTIVE)
+
+
+def test_bucket_of_its_own_without_state_file():
+    _bucket(None).acquire(10, quota.INTERACTIVE)
+
+    _bucket(None).acquire(10, quota.INTERACTIVE)
+
+
+def test_state_file_is_replaced_whole(tmp_path, monkeypatch):
+    path = tmp_path / "quota.json"
+    bucket = _bucket(path)
+    bucket.acquire(4, quota.INTERACTIVE)
+
+    def killed(*args):
+        raise OSError("killed while saving")
+
+    # a process killed before the state file is replaced leaves the previous state
+    monkeypatch.setattr(quota.os, "replace", killed)
+    with pytest.raises(OSError):
+        bucket.acquire(4, quota.INTERACTIVE)
+    monkeypatch.undo()
+
+    assert _bucket(path).stats()["remaining"] == 6
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["quota.json", "quota.json.lock"]
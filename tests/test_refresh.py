@@ -0,0 +1,69 @@
+import pytest
+from googleapiclient.errors import HttpError
+
+from backend import app, db
+
+pytestmark = pytest.mark.usefixtures("no_word_cloud")
+
+
+def _comments(first, last):
+    """Comments numbered from last down to first, newest first."""
+    return [(f"c{i}", f"great comment number {i}") for i in range(last, first - 1, -1)]
+
+
+def test_refresh_fetches_only_new_comments(youtube):
+    youtube.add_video("refresh0001", _comments(1, 5))
+    first = app._run_pipeline("refresh0001", False)
+    youtube.comments["refresh0001"] = _comments(1, 7)
+    youtube.calls.clear()
+
+    second = app._run_pipeline("refresh0001", True)
+
+    assert [query["order"] for method, query in youtube.calls if method == "commentThreads"] == [["time"]]
+    video = db.DBM.select_video_meta("refresh0001")
+    assert video.comment_ids == ["c7", "c6", "c5", "c4", "c3", "c2", "c1"]
+    assert second.latest_update > first.latest_update
+
+
+def test_failed_refresh_leaves_entry_unchanged(youtube):
+    youtube.add_video("refresh0002", _comments(1, 5))
+    first = app._run_pipeline("refresh0002", False)
+    youtube.comments["refresh0002"] = _comments(1, 7)
+    youtube.errors["commentThreads"] = 403
+
+    with pytest.raises(HttpError):
+        app._run_pipeline("refresh0002", True)
+
+    entry = db.DBM.lookup("refresh0002")
+    assert entry.latest_update == first.latest_update
+    assert entry.expires_at == first.expires_at
+    assert db.DBM.select_video_meta("refresh0002").comment_ids == ["c5", "c4", "c3", "c2", "c1"]
+
+    # the next refresh picks the new comments up
+    del youtube.errors["commentThreads"]
+    app._run_pipeline("refresh0002", True)
+    assert db.DBM.select_video_meta("refresh0002").comment_ids[:2] == ["c7", "c6"]
+
+
+def test_refresh_of_disabled_comments_keeps_snapshot(youtube):
+    youtube.add_video("refresh0003", _comments(1, 5))
+    first = app._run_pipeline("refresh0003", False)
+    youtube.errors["commentThreads"] = (403, "commentsDisabled")
+
+    second = app._run_pipeline("refresh0003", True)
+
+    # stored with a new expiry, not failed on every refresh
+    assert second.stored and second.latest_update > first.latest_update
+    assert db.DBM.lookup("refresh0003").expires_at == second.expires_at
+    assert second.report.attitude == first.report.attitude
+    assert db.DBM.select_video_meta("refresh0003").comment_ids == ["c5", "c4", "c3", "c2", "c1"]
+
+
+def test_failed_first_fetch_is_not_stored(client, youtube):
+    youtube.add_video("refresh0004", _comments(1, 5))
+    youtube.errors["commentThreads"] = 500
+
+    response = client.get("/analysis/refresh0004")
+
+    assert response.status_code == 502
+    assert not db.DBM.lookup("refresh0004").exists
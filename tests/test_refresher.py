@@ -0,0 +1,59 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend import app, db, quota, ttl
+from backend.refresher import Refresher
+
+pytestmark = pytest.mark.usefixtures("no_word_cloud")
+
+LATER = timedelta(days=365)
+
+
+def _comments(count):
+    return [(f"c{i}", f"great comment number {i}") for i in range(count, 0, -1)]
+
+
+def _refresh_in_background(vid):
+    job = app._jobs.submit(vid, vid, True, quota.BACKGROUND)
+    stop = time.monotonic() + 10
+    while not job.is_finished() and time.monotonic() < stop:
+        time.sleep(0.05)
+    return job
+
+
+def _due(vid):
+    return vid in db.DBM.select_soonest_expiring(1000, datetime.utcnow() + LATER)
+
+
+def test_failed_refresh_backs_off(youtube, monkeypatch):
+    youtube.add_video("backoff0001", _comments(3))
+    app._run_pipeline("backoff0001", False)
+    assert _due("backoff0001")
+    youtube.errors["commentThreads"] = 500
+
+    assert _refresh_in_background("backoff0001").error
+
+    # held back for the retry delay, not picked again every round
+    assert not _due("backoff0001")
+
+    # retried at once without a delay, and given up after repeated failures
+    monkeypatch.setattr(ttl, "REFRESH_RETRY_BASE", timedelta(0))
+    for _ in range(ttl.MAX_REFRESH_FAILURES - 1):
+        db.DBM.record_refresh_failure("backoff0001")
+    assert not _due("backoff0001")
+
+    # a successful refresh starts over
+    del youtube.errors["commentThreads"]
+    assert not _refresh_in_background("backoff0001").error
+    assert _due("backoff0001")
+
+
+def test_budget_charges_scheduled_refreshes_only():
+    running = {"vid1"}
+    refresher = Refresher(lambda limit, before: ["vid1", "vid2"], lambda vid: vid not in running,
+                          units_per_refresh=3, budget_units=100)
+
+    assert refresher.run_once() == 1
+    assert refresher.stats()["spent_units"] == 3
@@ -0,0 +1,28 @@
+import sys
+
+import pytest
+
+from backend import render
+
+
+def _app_imported() -> bool:
+    """Run in a worker process."""
+    return "backend.app" in sys.modules
+
+
+@pytest.fixture
+def renderer():
+    renderer = render.Renderer(workers=1)
+    yield renderer
+    renderer.shutdown()
+
+
+def test_render_in_worker(renderer):
+    png = renderer.render({"happy": 3, "sad": 1}, "en")
+
+    assert png.startswith(b"\x89PNG")
+    assert renderer.stats()["rendered"] == 1
+
+
+def test_worker_does_not_import_the_app(renderer):
+    assert not renderer._pool().submit(_app_imported).result(timeout=30)
@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+from backend.respcache import MARKER_BYTES, ResponseCache
+
+V1 = datetime(2024, 1, 1)
+V2 = V1 + timedelta(minutes=1)
+EXPIRES = V1 + timedelta(days=1)
+
+
+def test_put_of_older_version_after_write_is_dropped():
+    cache = ResponseCache(1 << 20)
+    cache.put("video", V1, EXPIRES, b'{"v": 1}')
+
+    # a reader loads version 1, then a write of version 2 invalidates it
+    cache.invalidate("video", V2)
+    stale = cache.put("video", V1, EXPIRES, b'{"v": 1}')
+
+    assert stale.identity == b'{"v": 1}'
+    assert cache.get("video") is None
+
+    cache.put("video", V2, EXPIRES, b'{"v": 2}')
+    assert cache.get("video").identity == b'{"v": 2}'
+
+
+def test_invalidate_keeps_newest_version():
+    cache = ResponseCache(1 << 20)
+    cache.put("video", V2, EXPIRES, b'{"v": 2}')
+    cache.invalidate("video", V1)
+
+    cache.put("video", V1, EXPIRES, b'{"v": 1}')
+
+    assert cache.get("video") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_markers_are_evicted_within_bound():
+    cache = ResponseCache(10 * MARKER_BYTES)
+    for index in range(100):
+        cache.invalidate(f"video{index}", V1)
+
+    stats = cache.stats()
+    assert stats["bytes"] <= 10 * MARKER_BYTES
+    assert stats["entries"] == 0
+    assert cache.get("video99") is None
@@ -0,0 +1,69 @@
+import threading
+import time
+
+from backend.singleflight import SingleFlight
+
+CALLERS = 8
+
+
+def _call_concurrently(flight, fn):
+    """Call flight.do("key", fn) from CALLERS threads, the followers arriving
+    while the leader runs; returns what each caller got."""
+    outcomes = []
+    lock = threading.Lock()
+
+    def caller():
+        try:
+            outcome = flight.do("key", fn)
+        except Exception as e:
+            outcome = e
+        with lock:
+            outcomes.append(outcome)
+
+    threads = [threading.Thread(target=caller) for _ in range(CALLERS)]
+    for thread in threads:
+        thread.start()
+    stop = time.monotonic() + 5
+    while flight.stats()["waiting"] < CALLERS - 1 and time.monotonic() < stop:
+        time.sleep(0.01)
+    return threads, outcomes
+
+
+def test_concurrent_callers_share_one_run():
+    flight, release, runs = SingleFlight(), threading.Event(), []
+
+    def fn():
+        runs.append(1)
+        release.wait(5)
+        return object()
+
+    threads, outcomes = _call_concurrently(flight, fn)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(runs) == 1
+    assert len(outcomes) == CALLERS and all(outcome is outcomes[0] for outcome in outcomes)
+    assert flight.leaders == 1 and flight.coalesced == CALLERS - 1
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_concurrent_callers_share_the_exception():
+    flight, release = SingleFlight(), threading.Event()
+    error = ValueError("upstream failed")
+
+    def fn():
+        release.wait(5)
+        raise error
+
+    threads, outcomes = _call_concurrently(flight, fn)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(outcomes) == CALLERS and all(outcome is error for outcome in outcomes)
+    assert flight.leaders == 1 and flight.coalesced == CALLERS - 1
+
+    # the failed call is forgotten, the next caller runs the function again
+    assert flight.do("key", lambda: 42) == 42
+    assert flight.leaders == 2
@@ -0,0 +1,76 @@
+import hashlib
+
+import pytest
+
+from backend import app, blobstore, datatypes, db
+
+
+def _legacy_report(vid, path):
+    """A report stored before the image store, holding the path of its image."""
+    return datatypes.Report(_id=vid, video_title="Legacy", attitude="Audiences are neutral",
+                            emoji="&#x1f636", wcloud=path, tags=[])
+
+
+def test_missing_legacy_image(client, tmp_path):
+    db.DBM.add_entry_to_db("legacy00001", None, _legacy_report("legacy00001", str(tmp_path / "gone.png")))
+
+    response = client.get("/analysis/legacy00001")
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["video_title"] == "Legacy"
+    assert body["wcloud_url"] is None and body["wcloud_hash"] is None
+    assert client.get("/wcloud/legacy00001/1.png").status_code == 404
+
+
+def test_legacy_image(client, tmp_path):
+    image = tmp_path / "wcloud.png"
+    image.write_bytes(b"\x89PNG legacy image")
+    digest = hashlib.sha256(image.read_bytes()).hexdigest()
+    db.DBM.add_entry_to_db("legacy00002", None, _legacy_report("legacy00002", str(image)))
+
+    body = client.get("/analysis/legacy00002").get_json()
+
+    assert body["wcloud_hash"] == digest
+    response = client.get(body["wcloud_url"])
+    assert response.status_code == 200
+    assert response.get_data() == image.read_bytes()
+    assert response.headers["ETag"] == f'"{digest}"'
+
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    store = blobstore.BlobStore(str(tmp_path / "wcloud.sqlite"))
+    monkeypatch.setattr(app, "_images", store)
+    monkeypatch.setattr(blobstore, "_store", store)
+    return store
+
+
+def _evict(store, digest):
+    store._connection().execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+
+
+def test_evicted_image_is_rendered_again(client, youtube, images):
+    youtube.add_video("evicted0001", [("c1", "great happy video"), ("c2", "awful sad sound")])
+    body = client.get("/analysis/evicted0001").get_json()
+    assert body["wcloud_hash"] in images
+    _evict(images, body["wcloud_hash"])
+
+    response = client.get(body["wcloud_url"])
+
+    assert response.status_code == 200
+    assert blobstore.digest_of(response.get_data()) == body["wcloud_hash"]
+    assert body["wcloud_hash"] in images
+
+
+def test_evicted_image_without_word_freq(client, images):
+    digest = images.put(b"\x89PNG old image")
+    report = datatypes.Report(_id="evicted0002", video_title="Old", attitude="Audiences are neutral",
+                              emoji="&#x1f636", wcloud=digest, wcloud_hash=digest, tags=[])
+    db.DBM.add_entry_to_db("evicted0002", None, report)
+    _evict(images, digest)
+
+    body = client.get("/analysis/evicted0002").get_json()
+
+    assert body["wcloud_url"] is None and body["wcloud_hash"] is None
+    assert client.get("/wcloud/evicted0002/1.png").status_code == 404
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+from backend import cache, db
+from backend.respcache import ResponseCache
+from backend.writebehind import MAX_ATTEMPTS, WriteBehind
+
+
+class _Table:
+    """Stand-in of the database, which fails every transaction holding a
+    bad row."""
+
+    def __init__(self, bad):
+        self.bad = bad
+        self.rows = {}
+
+    def write(self, rows):
+        if any(row["video_id"] in self.bad for row in rows):
+            raise ValueError("cannot write the row")
+        self.rows.update((row["video_id"], row) for row in rows)
+
+
+def test_bad_row_does_not_fail_the_batch():
+    table = _Table(bad={"bad"})
+    dropped = []
+    writer = WriteBehind(table.write, interval=0.01, on_drop=lambda key, row: dropped.append(key))
+    for key in ["good1", "good2", "bad", "good3", "good4", "good5"]:
+        writer.put(key, {"video_id": key})
+
+    assert writer.flush(timeout=5)
+    writer.stop()
+
+    assert sorted(table.rows) == ["good1", "good2", "good3", "good4", "good5"]
+    assert dropped == ["bad"]
+    stats = writer.stats()
+    assert stats["dropped"] == 1 and stats["rows"] == 5
+    assert writer.get("bad") is None
+
+
+def test_dropped_write_leaves_the_faster_tiers(monkeypatch):
+    memory = cache.MemoryTier()
+    monkeypatch.setattr(db.DBM, "_cache", cache.TieredCache([memory, cache.MemoryTier()]))
+    responses = ResponseCache(1 << 20)
+    monkeypatch.setattr(db.DBM, "_drop_listeners", [responses.discard])
+    latest_update = datetime(2024, 1, 1)
+    row = {"video_id": "dropped0001", "latest_update": latest_update}
+    db.DBM._cache.put("dropped0001", row)
+    responses.put("dropped0001", latest_update, latest_update, b"{}")
+
+    db.DBM._dropped("dropped0001", row)
+
+    assert memory.get("dropped0001") is None
+    assert responses.get("dropped0001") is None
+    # an older, stored version can be cached again
+    responses.put("dropped0001", datetime(2023, 1, 1), latest_update, b"{}")
+    assert responses.get("dropped0001") is not None
+
+
+def test_row_is_dropped_after_max_attempts():
+    table = _Table(bad={"bad"})
+    writer = WriteBehind(table.write, interval=0.01)
+    writer.put("bad", {"video_id": "bad"})
+
+    assert writer.flush(timeout=5)
+    writer.stop()
+
+    assert writer.stats()["failures"] == MAX_ATTEMPTS